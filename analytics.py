@@ -0,0 +1,476 @@
+import base64
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+try:
+    from matplotlib.figure import Figure
+except ImportError:
+    Figure = None
+
+from dataset import build_daily_rollup, with_daily_means
+from downsample import bin_points, downsample_line
+from metrics import stage, timed
+
+SELECTION_CACHE_SIZE = 8
+MAX_POINTS_PER_CHART = 2000
+FIGURE_CACHE_BYTES = 64 * 1024 * 1024
+FIGURE_WORKERS = min(4, os.cpu_count() or 1)
+
+_selections = OrderedDict()
+_selections_lock = threading.Lock()
+# Shared by every streamed /filter request, so concurrent dashboards can't oversubscribe the CPU
+_figure_pool = ThreadPoolExecutor(max_workers=FIGURE_WORKERS, thread_name_prefix='figure')
+
+
+def _date_bound(value, created_at):
+    # In the column's timezone, so day boundaries line up with the UTC-midnight rollup days
+    bound = pd.Timestamp(value)
+    if created_at.dt.tz is not None:
+        if bound.tzinfo is None:
+            bound = bound.tz_localize(created_at.dt.tz)
+        else:
+            bound = bound.tz_convert(created_at.dt.tz)
+    return bound.as_unit(created_at.dt.unit, round_ok=True)
+
+def date_window(created_at, start_date, end_date):
+    # Created At is sorted (NaT last), so the range is the positions [lo, hi) found by binary search
+    lo = created_at.searchsorted(_date_bound(start_date, created_at)) if start_date else 0
+    if end_date:
+        hi = created_at.searchsorted(_date_bound(end_date, created_at), side='right')
+    else:
+        hi = created_at.searchsorted(pd.NaT)
+    return lo, hi
+
+def _rows_in_window(rows, lo, hi):
+    # The sorted row positions that fall in [lo, hi)
+    return rows[np.searchsorted(rows, lo):np.searchsorted(rows, hi)]
+
+def _intersect(rows, other):
+    return other if rows is None else np.intersect1d(rows, other, assume_unique=True)
+
+def daily_totals(dataset, start_date=None, end_date=None, goals=None, df=None):
+    # df is only passed when rows were narrowed by something the rollup can't express (a search)
+    if df is not None:
+        return with_daily_means(build_daily_rollup(df).groupby(level='Day').sum())
+    created_at = dataset.df['Created At']
+    start = _date_bound(start_date, created_at) if start_date else None
+    end = _date_bound(end_date, created_at) if end_date else None
+    return dataset.daily_totals(start, end, goals)
+
+def goal_counts(df):
+    counts = df['Goal'].value_counts()
+    return counts[counts > 0]
+
+@timed('summary_stats')
+def summary_stats(df):
+    return {
+        'total_sessions': len(df),
+        'average_session_time': float(df['Time'].mean()),
+        'median_session_time': float(df['Time'].median()),
+        'total_elapsed_time': int(df['Elapsed'].sum()),
+        'sessions_per_goal': {str(goal): int(count) for goal, count in goal_counts(df).items()}
+    }
+
+
+class Chart:
+    # Backend-neutral description of one figure: the (already reduced) data plus labels
+    def __init__(self, name, kind, data, x, y, title, xaxis_title, yaxis_title, tickangle=None, nbins=None,
+                 size=None):
+        self.name = name
+        self.kind = kind
+        self.data = data
+        self.x = x
+        self.y = y
+        self.title = title
+        self.xaxis_title = xaxis_title
+        self.yaxis_title = yaxis_title
+        self.tickangle = tickangle
+        self.nbins = nbins
+        self.size = size
+
+
+def _session_time_over_time(selection):
+    return Chart('session_time_over_time', 'line', selection.frame(['Created At', 'Time']), 'Created At', 'Time',
+                 'Session Time Over Time', 'Date', 'Session Time (minutes)', tickangle=45)
+
+def _goal_distribution(selection):
+    return Chart('goal_distribution', 'histogram', selection.frame(['Goal']), 'Goal', None,
+                 'Goal Distribution', 'Goal', 'Count', tickangle=45)
+
+def _session_duration_distribution(selection):
+    return Chart('session_duration_distribution', 'histogram', selection.frame(['Time']), 'Time', None,
+                 'Session Duration Distribution', 'Session Duration (minutes)', 'Frequency', nbins=20)
+
+def _elapsed_time_by_goal(selection):
+    # One bar per goal instead of one stacked segment per session
+    totals = selection.frame(['Goal', 'Elapsed'], filtered=True).groupby('Goal', observed=True)['Elapsed'].sum()
+    totals = totals.reset_index()
+    return Chart('elapsed_time_by_goal', 'bar', totals, 'Goal', 'Elapsed',
+                 'Total Elapsed Time by Goal (Excluding 60-min Sessions)', 'Goal', 'Total Elapsed Time (minutes)',
+                 tickangle=45)
+
+def _session_time_vs_elapsed(selection):
+    return Chart('session_time_vs_elapsed', 'scatter', selection.frame(['Time', 'Elapsed'], filtered=True), 'Time', 'Elapsed',
+                 'Session Time vs Elapsed Time (Excluding 60-min Sessions)',
+                 'Session Time (minutes)', 'Elapsed Time (minutes)')
+
+def _average_elapsed_time(selection):
+    return Chart('average_elapsed_time', 'line', selection.frame(['Created At', 'Elapsed'], filtered=True), 'Created At',
+                 'Elapsed', 'Average Elapsed Time per Session Over Time (Excluding 60-min Sessions)',
+                 'Date', 'Average Elapsed Time (minutes)', tickangle=45)
+
+def _sessions_over_time(selection):
+    sessions = selection.daily['sessions'].reset_index()
+    return Chart('sessions_over_time', 'line', sessions, 'Day', 'sessions',
+                 'Number of Sessions Over Time', 'Date', 'Number of Sessions', tickangle=45)
+
+def _total_elapsed_time_over_time(selection):
+    daily = selection.daily
+    elapsed = daily.loc[daily['sessions_excl_60'] > 0, 'elapsed_excl_60'].reset_index()
+    return Chart('total_elapsed_time_over_time', 'line', elapsed, 'Day', 'elapsed_excl_60',
+                 'Total Elapsed Time Over Time (Excluding 60-min Sessions)', 'Date', 'Total Elapsed Time (minutes)',
+                 tickangle=45)
+
+@timed('downsample')
+def downsample(chart, max_points):
+    # Lines keep their shape through LTTB; a scatter becomes weighted points, one per
+    # distinct (or binned) position, sized by how many sessions fall there
+    if not max_points or len(chart.data) <= max_points:
+        return chart
+    if chart.kind == 'line':
+        chart.data = downsample_line(chart.data, chart.x, chart.y, max_points)
+    elif chart.kind == 'scatter':
+        chart.data = bin_points(chart.data, chart.x, chart.y, max_points)
+        chart.size = 'Sessions'
+    return chart
+
+# In the order the dashboard and report lay them out
+CHARTS = OrderedDict([
+    ('session_time_over_time', _session_time_over_time),
+    ('goal_distribution', _goal_distribution),
+    ('session_duration_distribution', _session_duration_distribution),
+    ('elapsed_time_by_goal', _elapsed_time_by_goal),
+    ('session_time_vs_elapsed', _session_time_vs_elapsed),
+    ('average_elapsed_time', _average_elapsed_time),
+    ('sessions_over_time', _sessions_over_time),
+    ('total_elapsed_time_over_time', _total_elapsed_time_over_time),
+])
+
+PLOTLY_BUILDERS = {
+    'line': px.line,
+    'histogram': px.histogram,
+    'bar': px.bar,
+    'scatter': px.scatter,
+}
+
+def to_plotly(chart):
+    options = {'nbins': chart.nbins} if chart.nbins else {}
+    if chart.size:
+        options['size'] = chart.size
+    fig = PLOTLY_BUILDERS[chart.kind](chart.data, x=chart.x, y=chart.y, title=chart.title, **options)
+    layout = {'xaxis_title': chart.xaxis_title, 'yaxis_title': chart.yaxis_title}
+    if chart.tickangle:
+        layout['xaxis'] = dict(tickangle=chart.tickangle)
+    fig.update_layout(**layout)
+    return fig
+
+def _naive_utc(series):
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        return series.dt.tz_convert('UTC').dt.tz_localize(None)
+    return series
+
+def to_matplotlib(chart, figsize=(10, 6)):
+    # A bare Figure draws through Agg without touching pyplot's global state, so
+    # charts can be rendered headless and from several processes at once
+    fig = Figure(figsize=figsize)
+    ax = fig.add_subplot()
+    data = chart.data
+    if chart.kind == 'histogram':
+        values = data[chart.x]
+        if pd.api.types.is_numeric_dtype(values):
+            ax.hist(values.dropna().to_numpy(), bins=chart.nbins or 'auto')
+        else:
+            counts = values.value_counts(sort=False)
+            counts = counts[counts > 0]
+            ax.bar(counts.index.astype(str), counts.to_numpy())
+    elif chart.kind == 'bar':
+        ax.bar(data[chart.x].astype(str), data[chart.y].to_numpy())
+    elif chart.kind == 'line':
+        ax.plot(_naive_utc(data[chart.x]).to_numpy(), data[chart.y].to_numpy())
+    elif chart.kind == 'scatter':
+        sizes = None
+        if chart.size and len(data):
+            # Marker area proportional to the number of sessions at each point
+            counts = data[chart.size].to_numpy()
+            sizes = 4 + 400 * counts / counts.max()
+        ax.scatter(data[chart.x].to_numpy(), data[chart.y].to_numpy(), s=sizes, alpha=0.7)
+    ax.set_title(chart.title)
+    ax.set_xlabel(chart.xaxis_title)
+    ax.set_ylabel(chart.yaxis_title)
+    if chart.tickangle:
+        ax.tick_params(axis='x', labelrotation=chart.tickangle)
+    fig.tight_layout()
+    return fig
+
+
+def _typed_array(values):
+    # Numeric columns travel as base64 typed arrays instead of decimal text
+    values = np.asarray(values)
+    if values.dtype.kind in 'iub' and (len(values) == 0 or
+                                       (values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max)):
+        values, dtype = values.astype('<i4'), 'i4'
+    else:
+        values, dtype = values.astype('<f8'), 'f8'
+    return {'dtype': dtype, 'bdata': base64.b64encode(values.tobytes()).decode('ascii')}
+
+def _axis(series):
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        series = series.dt.tz_localize(None)
+    if pd.api.types.is_datetime64_any_dtype(series):
+        # Milliseconds since the epoch; the axis is typed as a date axis in the layout
+        millis = series.to_numpy(dtype='datetime64[ms]').astype('int64').astype('f8')
+        millis[series.isna().to_numpy()] = np.nan
+        return _typed_array(millis), 'date'
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return _typed_array(series.to_numpy()), None
+    return series.astype(str).tolist(), 'category'
+
+def _histogram_trace(chart):
+    values = chart.data[chart.x]
+    if pd.api.types.is_numeric_dtype(values):
+        counts, edges = np.histogram(values.dropna().to_numpy(), bins=chart.nbins or 'auto')
+        return {'type': 'bar', 'x': _typed_array((edges[:-1] + edges[1:]) / 2), 'y': _typed_array(counts),
+                'width': _typed_array(np.diff(edges))}, None
+    counts = values.value_counts(sort=False)
+    counts = counts[counts > 0]
+    return {'type': 'bar', 'x': counts.index.astype(str).tolist(), 'y': _typed_array(counts.to_numpy())}, 'category'
+
+@timed('render_spec')
+def render_spec(chart):
+    # Minimal plotly.js figure: one trace, typed numeric arrays and only the layout
+    # keys the chart sets; the dashboard supplies everything else
+    if chart.kind == 'histogram':
+        trace, x_type = _histogram_trace(chart)
+    else:
+        x, x_type = _axis(chart.data[chart.x])
+        y, _ = _axis(chart.data[chart.y])
+        trace = {'type': 'bar' if chart.kind == 'bar' else 'scatter', 'x': x, 'y': y}
+        if chart.kind != 'bar':
+            trace['mode'] = 'lines' if chart.kind == 'line' else 'markers'
+        if chart.size:
+            # Same area scaling px.scatter applies, largest marker 20px across
+            sizes = chart.data[chart.size].to_numpy()
+            trace['marker'] = {'size': _typed_array(sizes), 'sizemode': 'area',
+                               'sizeref': 2.0 * sizes.max() / 20 ** 2, 'sizemin': 2}
+    xaxis = {'title': {'text': chart.xaxis_title}}
+    if x_type:
+        xaxis['type'] = x_type
+    if chart.tickangle:
+        xaxis['tickangle'] = chart.tickangle
+    layout = {'title': {'text': chart.title}, 'xaxis': xaxis, 'yaxis': {'title': {'text': chart.yaxis_title}}}
+    return json.dumps({'data': [trace], 'layout': layout}, separators=(',', ':'))
+
+
+class RenderCache:
+    # LRU of rendered payloads bounded by their total size in bytes
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+        # Render outside the lock; two requests racing on the same key just both render it
+        value = render()
+        size = len(value)
+        if size > self.max_bytes:
+            return value
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = value
+                self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+figure_cache = RenderCache(FIGURE_CACHE_BYTES)
+
+@timed('render_html')
+def render_html(chart):
+    # The dashboard loads plotly.js once itself; embedding it would add ~4 MB per figure
+    return to_plotly(chart).to_html(full_html=False, include_plotlyjs=False)
+
+def rendered_figures(selection, names, render=render_html, format='html'):
+    # Keyed by (dataset version, normalized filters, format, plot name), so any
+    # dashboard repeating a filter combination gets the stored payloads back
+    return [
+        figure_cache.get_or_render(selection.key + (format, name), lambda name=name: render(selection.chart(name)))
+        for name in CHARTS if name in names
+    ]
+
+def submit_figures(selection, names, render=render_html, format='html'):
+    # Renders the figures concurrently on the figure pool, through the same cache as
+    # rendered_figures. Returns {future: (position, name)} in dashboard order.
+    futures = {}
+    for position, name in enumerate(name for name in CHARTS if name in names):
+        future = _figure_pool.submit(figure_cache.get_or_render, selection.key + (format, name),
+                                     lambda name=name: render(selection.chart(name)))
+        futures[future] = (position, name)
+    return futures
+
+
+class Selection:
+    # One filtered view of a dataset. Everything is computed on first use and kept,
+    # so a route only pays for the stats and charts it actually asks for.
+    def __init__(self, dataset, start_date=None, end_date=None, goals=(), search_query=None, search_mode=None,
+                 max_points=MAX_POINTS_PER_CHART):
+        self.dataset = dataset
+        self.key = (dataset.version,) + filter_key(start_date, end_date, goals, search_query, search_mode) + (max_points,)
+        self.max_points = max_points
+        self.start_date = start_date
+        self.end_date = end_date
+        self.goals = list(goals)
+        self.search_query = search_query
+        self.search_mode = search_mode
+        self._charts = {}
+        self._chart_locks = {}
+        self._lock = threading.Lock()
+
+    @cached_property
+    def _window(self):
+        if self.start_date or self.end_date:
+            return date_window(self.dataset.df['Created At'], self.start_date, self.end_date)
+        return 0, len(self.dataset.df)
+
+    def _narrow(self, rows=None):
+        # Sorted row positions in the date window matching the goal and search filters,
+        # or None when no filter applies and the selection is the whole window
+        lo, hi = self._window
+        dataset = self.dataset
+        if self.goals:
+            rows = _intersect(rows, _rows_in_window(dataset.rows_with_goals(self.goals), lo, hi))
+        if self.search_query:
+            with stage('search'):
+                if self.search_mode == 'words':
+                    rows = _intersect(rows, _rows_in_window(dataset.rows_with_words(self.search_query), lo, hi))
+                else:
+                    mask = dataset.search_mask(self.search_query)
+                    rows = lo + np.flatnonzero(mask[lo:hi]) if rows is None else rows[mask[rows]]
+        return rows
+
+    @cached_property
+    def rows(self):
+        with stage('filter'):
+            return self._narrow()
+
+    @cached_property
+    def rows_filtered(self):
+        # Excluding 60-minute sessions
+        with stage('filter'):
+            lo, hi = self._window
+            return self._narrow(_rows_in_window(self.dataset.rows_excluding_60_min, lo, hi))
+
+    def frame(self, columns, filtered=False):
+        # Just the given columns of the selected rows: a slice when only dates are
+        # filtered, otherwise a take of those columns, never a copy of the whole frame
+        rows = self.rows_filtered if filtered else self.rows
+        df = self.dataset.df[columns]
+        if rows is None:
+            lo, hi = self._window
+            return df.iloc[lo:hi]
+        return df.take(rows)
+
+    @cached_property
+    def df(self):
+        return self.frame(list(self.dataset.df.columns))
+
+    @cached_property
+    def df_filtered(self):
+        return self.frame(list(self.dataset.df.columns), filtered=True)
+
+    @cached_property
+    def daily(self):
+        with stage('daily_totals'):
+            if self.search_query:
+                return daily_totals(self.dataset, df=self.frame(['Created At', 'Time', 'Elapsed', 'Goal']))
+            return daily_totals(self.dataset, self.start_date, self.end_date, self.goals)
+
+    @cached_property
+    def summary_stats(self):
+        return summary_stats(self.frame(['Time', 'Elapsed', 'Goal']))
+
+    def chart(self, name):
+        # One lock per chart, so different charts of a selection can be built at once
+        with self._lock:
+            lock = self._chart_locks.setdefault(name, threading.Lock())
+        with lock:
+            if name not in self._charts:
+                with stage('build_chart'):
+                    chart = CHARTS[name](self)
+                self._charts[name] = downsample(chart, self.max_points)
+            return self._charts[name]
+
+    def charts(self, names):
+        return [self.chart(name) for name in CHARTS if name in names]
+
+
+def filter_key(start_date=None, end_date=None, goals=(), search_query=None, search_mode=None):
+    search_query = (search_query or '').lower() or None
+    return (start_date or None, end_date or None, tuple(sorted(set(goals))), search_query,
+            search_mode if search_query else None)
+
+def select(dataset, start_date=None, end_date=None, goals=(), search_query=None, search_mode=None,
+           max_points=MAX_POINTS_PER_CHART, selection_class=Selection):
+    key = (dataset.version,) + filter_key(start_date, end_date, goals, search_query, search_mode) + (max_points,)
+    with _selections_lock:
+        selection = _selections.get(key)
+        if selection is not None:
+            _selections.move_to_end(key)
+            return selection
+        selection = selection_class(dataset, *key[1:])
+        # Selections of an older version of the same data would only keep that data alive
+        if dataset.source is not None:
+            for stale in [cached_key for cached_key, cached in _selections.items()
+                          if cached.dataset.source == dataset.source and cached.dataset.version != dataset.version]:
+                del _selections[stale]
+        _selections[key] = selection
+        while len(_selections) > SELECTION_CACHE_SIZE:
+            _selections.popitem(last=False)
+        return selection
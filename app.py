@@ -1,10 +1,8 @@
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, session
-import pandas as pd
-import plotly.express as px
+from flask import Flask, Response, abort, render_template, request, jsonify, send_file, redirect, url_for, session
+import numpy as np
 import plotly.graph_objects as go
+from plotly.offline import get_plotlyjs_version
 from plotly.subplots import make_subplots
-from io import BytesIO
-from io import BytesIO
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
@@ -13,8 +11,24 @@ from email import encoders
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
-from fpdf import FPDF
+import gzip
+import json
+from concurrent.futures import as_completed
 import os
+import metrics
+from dataset import load_dataset, memory_reports
+from datatable import parse_range, parse_request, table_response
+from export import EXCEL_MAX_ROWS, iter_csv, iter_excel, xlsxwriter
+from ingest import MAX_UPLOAD_BYTES, ingest_csv, ingest_status, ingest_store, save_upload, submit_ingest
+from reports import report_path, report_status, submit_report
+from analytics import (MAX_POINTS_PER_CHART, figure_cache, render_html, render_spec, rendered_figures, select,
+                       submit_figures)
+from store import StoreSelection, UserSessions, open_store
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'  # Replace with your secret key
@@ -65,107 +79,114 @@ USERS = {
 }
 @app.route('/get_sessions_data', methods=['POST'])
 def get_sessions_data():
-    df = read_csv(CSV_FILE_PATH)
-    df = preprocess_data(df)
-    
-    # Convert dataframe to list of dicts
-    data = df.to_dict(orient='records')
-    
-    return jsonify({
-        "data": data
-    })
+    params = parse_request(request.form)
+
+    # The duration/goal filter panel sends its values along with each table draw
+    bounds = None
+    if request.form.get('duration_range'):
+        bounds = parse_range(request.form['duration_range'])
+    selected_goals = request.form.getlist('goals[]') or request.form.getlist('goals')
+
+    if app.config['SESSION_STORE']:
+        sessions = user_sessions()
+        min_time, max_time = bounds or (None, None)
+        with metrics.stage('table_page'):
+            body = sessions.store.table_response(sessions.user_id, params, goals=selected_goals,
+                                                 min_time=min_time, max_time=max_time)
+        return app.response_class(body, mimetype='application/json')
+
+    dataset = current_dataset()
+    rows = None
+    if bounds:
+        rows = dataset.rows_with_time(*bounds)
+    if selected_goals:
+        goal_rows = dataset.rows_with_goals(selected_goals)
+        rows = goal_rows if rows is None else np.intersect1d(rows, goal_rows, assume_unique=True)
+
+    with metrics.stage('table_page'):
+        body = table_response(dataset, params, rows)
+    return app.response_class(body, mimetype='application/json')
 
 @app.route('/export_data', methods=['POST'])
 def export_data():
+    # Same filters as /filter; the file is produced chunk by chunk while it is sent
+    df = selection_from_form(request.form).df
     if 'export_csv' in request.form:
-        # Generate and return CSV file
-        pass
+        return Response(iter_csv(df), mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=arcade_sessions.csv'})
     elif 'export_excel' in request.form:
-        # Generate and return Excel file
-        pass
+        if xlsxwriter is None:
+            return jsonify({'error': 'Excel export requires XlsxWriter'}), 501
+        if len(df) > EXCEL_MAX_ROWS:
+            return jsonify({'error': f'Excel sheets hold at most {EXCEL_MAX_ROWS} rows; export as CSV instead'}), 400
+        return Response(iter_excel(df),
+                        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                        headers={'Content-Disposition': 'attachment; filename=arcade_sessions.xlsx'})
+    return redirect(url_for('index'))
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Larger uploads are refused with 413 before anything is written
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+# Upper bound on points sent per line/scatter chart; larger selections are downsampled
+app.config['MAX_POINTS_PER_CHART'] = MAX_POINTS_PER_CHART
+# SQLite file holding every user's sessions; each request then only reads the logged-in
+# user's rows. None serves the single shared CSV_FILE_PATH instead.
+app.config['SESSION_STORE'] = None
+# Load the CSV with the compact dtypes of dataset.compact_frame (int8/int16 minutes, interned Work)
+app.config['COMPACT_DATASETS'] = False
+# plotly.js matching the installed plotly.py; older builds can't decode the typed arrays in /filter specs
+app.config['PLOTLY_JS_URL'] = 'https://cdn.plot.ly/plotly-%s.min.js' % get_plotlyjs_version()
+
+def current_dataset():
+    return load_dataset(CSV_FILE_PATH, compact=app.config['COMPACT_DATASETS'])
+
+def user_sessions():
+    if 'username' not in session:
+        abort(401)
+    return UserSessions(open_store(app.config['SESSION_STORE']), session['username'])
+
+def select_sessions(start_date=None, end_date=None, goals=(), search_query=None, search_mode=None):
+    max_points = app.config['MAX_POINTS_PER_CHART']
+    if app.config['SESSION_STORE']:
+        return select(user_sessions(), start_date, end_date, goals, search_query, search_mode, max_points,
+                      selection_class=StoreSelection)
+    return select(current_dataset(), start_date, end_date, goals, search_query, search_mode, max_points)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def read_csv(file_path):
-    return pd.read_csv(file_path, encoding='ISO-8859-1')
-
-def preprocess_data(df):
-    df['Created At'] = pd.to_datetime(df['Created At'], errors='coerce')
-    return df
-
-def filter_sessions(df):
-    return df[df['Time'] != 60]
 @app.route('/filter_sessions', methods=['POST'])
-def filter_sessions():
-    df = read_csv(CSV_FILE_PATH)
-    df = preprocess_data(df)
-    
+def filtered_sessions():
     # Retrieve filters from request
     duration_range = request.form['duration_range'].split(' - ')
     min_duration, max_duration = int(duration_range[0]), int(duration_range[1])
     selected_goals = request.form.getlist('goals')
+
+    if app.config['SESSION_STORE']:
+        sessions = user_sessions()
+        df_filtered = sessions.store.sessions(sessions.user_id, goals=selected_goals, min_time=min_duration,
+                                              max_time=max_duration)
+        return jsonify({"data": df_filtered.to_dict(orient='records')})
+    dataset = current_dataset()
     
     # Apply filters
-    df_filtered = df[(df['Time'] >= min_duration) & (df['Time'] <= max_duration)]
+    rows = dataset.rows_with_time(min_duration, max_duration)
     if selected_goals:
-        df_filtered = df_filtered[df_filtered['Goal'].isin(selected_goals)]
+        rows = np.intersect1d(rows, dataset.rows_with_goals(selected_goals), assume_unique=True)
+    df_filtered = dataset.df.take(rows)
     
     # Return filtered data
     data = df_filtered.to_dict(orient='records')
     return jsonify({"data": data})
 
-def filter_by_date(df, start_date, end_date):
-    if start_date:
-        df = df[df['Created At'] >= pd.to_datetime(start_date)]
-    if end_date:
-        df = df[df['Created At'] <= pd.to_datetime(end_date)]
-    return df
-
-def filter_by_goal(df, goals):
-    if goals:
-        df = df[df['Goal'].isin(goals)]
-    return df
-
-def search_data(df, query):
-    return df[df.apply(lambda row: row.astype(str).str.contains(query, case=False).any(), axis=1)]
-
-def create_pdf_report(plots, summary_stats):
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size=12)
-
-    # Add summary stats
-    pdf.cell(200, 10, txt="Arcade Sessions Report", ln=True, align='C')
-    pdf.ln(10)
-    pdf.cell(200, 10, txt=f"Total Sessions: {summary_stats['total_sessions']}", ln=True)
-    pdf.cell(200, 10, txt=f"Average Session Time: {summary_stats['average_session_time']:.2f} minutes", ln=True)
-    pdf.cell(200, 10, txt=f"Median Session Time: {summary_stats['median_session_time']:.2f} minutes", ln=True)
-    pdf.cell(200, 10, txt=f"Total Elapsed Time: {summary_stats['total_elapsed_time']} minutes", ln=True)
-
-    pdf.ln(10)
-    pdf.cell(200, 10, txt="Sessions per Goal:", ln=True)
-    for goal, count in summary_stats['sessions_per_goal'].items():
-        pdf.cell(200, 10, txt=f"{goal}: {count}", ln=True)
-
-    # Add plots as images
-    for plot in plots:
-        img_buffer = BytesIO()
-        plot.write_image(img_buffer, format='png')
-        img_buffer.seek(0)
-        pdf.image(img_buffer, x=10, y=None, w=180)
-
-    return pdf
-
 @app.route('/')
 def index():
     if 'username' not in session:
         return redirect(url_for('login'))
-    df = read_csv(CSV_FILE_PATH)
-    df = preprocess_data(df)
-    goals = df['Goal'].unique()
+    if app.config['SESSION_STORE']:
+        goals = user_sessions().goals
+    else:
+        goals = current_dataset().df['Goal'].unique()
     return render_template('index.html', goals=goals)
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -187,166 +208,108 @@ def logout():
     session.pop('role', None)
     return redirect(url_for('login'))
 
+def selection_from_form(form):
+    start_date = form.get('start_date')
+    end_date = form.get('end_date')
+    selected_goals = form.getlist('goals')
+    search_query = form.get('search_query')
+    search_mode = form.get('search_mode')
+    return select_sessions(start_date, end_date, selected_goals, search_query, search_mode)
+
+def stream_filter(selection, plot_names, spec):
+    # NDJSON: the summary stats line first, then one line per figure in the order the
+    # figures finish; "index" is the figure's place on the dashboard
+    if not selection.summary_stats['total_sessions']:
+        yield '{"no_data":true}\n'
+        return
+    yield '{"summary_stats":%s,"no_data":false}\n' % json.dumps(selection.summary_stats)
+    if spec:
+        futures = submit_figures(selection, plot_names, render_spec, 'spec')
+    else:
+        futures = submit_figures(selection, plot_names, render_html, 'html')
+    for future in as_completed(futures):
+        index, name = futures[future]
+        try:
+            figure = future.result()
+        except Exception as e:
+            app.logger.exception('Rendering %s failed', name)
+            yield json.dumps({'index': index, 'name': name, 'error': str(e) or type(e).__name__}) + '\n'
+            continue
+        if spec:
+            # Specs are cached as JSON already; splice them in as in the buffered response
+            yield '{"index":%d,"name":%s,"figure":%s}\n' % (index, json.dumps(name), figure)
+        else:
+            yield json.dumps({'index': index, 'name': name, 'plot': figure}) + '\n'
+
 @app.route('/filter', methods=['POST'])
 def filter_data():
-    start_date = request.form.get('start_date')
-    end_date = request.form.get('end_date')
-    selected_goals = request.form.getlist('goals')
-    search_query = request.form.get('search_query')
-    
-    df = read_csv(CSV_FILE_PATH)
-    df = preprocess_data(df)
-    df_filtered = filter_sessions(df)
-    
-    if start_date or end_date:
-        df = filter_by_date(df, start_date, end_date)
-        df_filtered = filter_by_date(df_filtered, start_date, end_date)
-
-    if selected_goals:
-        df = filter_by_goal(df, selected_goals)
-        df_filtered = filter_by_goal(df_filtered, selected_goals)
+    selection = selection_from_form(request.form)
+    plot_names = request.form.getlist('plot_options')
 
-    if search_query:
-        df = search_data(df, search_query)
-        df_filtered = search_data(df_filtered, search_query)
+    if request.form.get('stream'):
+        # Stats are sent at once and each figure as soon as it is rendered, rather
+        # than waiting for the slowest one
+        return Response(stream_filter(selection, plot_names, request.form.get('response_format') == 'spec'),
+                        mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
 
-    if df.empty:
+    # Counted without loading rows, which matters when the selection comes from the store
+    if not selection.summary_stats['total_sessions']:
         return jsonify({'no_data': True})
 
-    # Generate summary statistics
-    summary_stats = {
-        'total_sessions': len(df),
-        'average_session_time': df['Time'].mean(),
-        'median_session_time': df['Time'].median(),
-        'total_elapsed_time': df['Elapsed'].sum(),
-        'sessions_per_goal': df['Goal'].value_counts().to_dict()
-    }
+    # Rendered plots are cached per dataset version, filters and plot
+    if request.form.get('response_format') == 'spec':
+        # Compact plotly.js specs rendered by the page itself; the cached specs are
+        # already JSON, so splice them in rather than re-encoding them
+        figures = rendered_figures(selection, plot_names, render_spec, 'spec')
+        body = '{"summary_stats":%s,"figures":[%s],"no_data":false}' % (
+            json.dumps(selection.summary_stats), ','.join(figures))
+        return app.response_class(body, mimetype='application/json')
 
-    # Generate plots
-    plots = []
-    plot_names = request.form.getlist('plot_options')
-
-    if 'session_time_over_time' in plot_names:
-        fig1 = px.line(df, x='Created At', y='Time', title='Session Time Over Time')
-        fig1.update_layout(xaxis_title='Date', yaxis_title='Session Time (minutes)', xaxis=dict(tickangle=45))
-        plots.append(fig1)
-
-    if 'goal_distribution' in plot_names:
-        fig2 = px.histogram(df, x='Goal', title='Goal Distribution')
-        fig2.update_layout(xaxis_title='Goal', yaxis_title='Count', xaxis=dict(tickangle=45))
-        plots.append(fig2)
-
-    if 'session_duration_distribution' in plot_names:
-        fig3 = px.histogram(df, x='Time', nbins=20, title='Session Duration Distribution')
-        fig3.update_layout(xaxis_title='Session Duration (minutes)', yaxis_title='Frequency')
-        plots.append(fig3)
-
-    if 'elapsed_time_by_goal' in plot_names:
-        fig4 = px.bar(df_filtered, x='Goal', y='Elapsed', title='Total Elapsed Time by Goal (Excluding 60-min Sessions)', 
-                      labels={'Elapsed':'Total Elapsed Time (minutes)'})
-        fig4.update_layout(xaxis=dict(tickangle=45))
-        plots.append(fig4)
-
-    if 'session_time_vs_elapsed' in plot_names:
-        fig5 = px.scatter(df_filtered, x='Time', y='Elapsed', title='Session Time vs Elapsed Time (Excluding 60-min Sessions)')
-        fig5.update_layout(xaxis_title='Session Time (minutes)', yaxis_title='Elapsed Time (minutes)')
-        plots.append(fig5)
-
-    if 'average_elapsed_time' in plot_names:
-        fig6 = px.line(df_filtered, x='Created At', y='Elapsed', title='Average Elapsed Time per Session Over Time (Excluding 60-min Sessions)')
-        fig6.update_layout(xaxis_title='Date', yaxis_title='Average Elapsed Time (minutes)', xaxis=dict(tickangle=45))
-        plots.append(fig6)
-
-    if 'sessions_over_time' in plot_names:
-        sessions_over_time = df.groupby(df['Created At'].dt.date).size()
-        fig7 = px.line(sessions_over_time, title='Number of Sessions Over Time')
-        fig7.update_layout(xaxis_title='Date', yaxis_title='Number of Sessions', xaxis=dict(tickangle=45))
-        plots.append(fig7)
-
-    if 'total_elapsed_time_over_time' in plot_names:
-        total_elapsed_over_time = df_filtered.groupby(df_filtered['Created At'].dt.date)['Elapsed'].sum()
-        fig8 = px.line(total_elapsed_over_time, title='Total Elapsed Time Over Time (Excluding 60-min Sessions)')
-        fig8.update_layout(xaxis_title='Date', yaxis_title='Total Elapsed Time (minutes)', xaxis=dict(tickangle=45))
-        plots.append(fig8)
-
-    # Convert plots to HTML for display
-    plots_html = [plot.to_html(full_html=False) for plot in plots]
+    plots_html = rendered_figures(selection, plot_names)
 
     return jsonify({
-        'summary_stats': summary_stats,
+        'summary_stats': selection.summary_stats,
         'plots': plots_html,
         'no_data': False
     })
 
 @app.route('/generate_report', methods=['POST'])
 def generate_report():
-    df = read_csv(CSV_FILE_PATH)
-    df = preprocess_data(df)
-    df_filtered = filter_sessions(df)
-
-    # Generate summary statistics
-    summary_stats = {
-        'total_sessions': len(df),
-        'average_session_time': df['Time'].mean(),
-        'median_session_time': df['Time'].median(),
-        'total_elapsed_time': df['Elapsed'].sum(),
-        'sessions_per_goal': df['Goal'].value_counts().to_dict()
-    }
+    selection = select_sessions()
 
-    # Generate plots
-    plots = []
+    # Rendering and PDF assembly run in the report worker pool; poll the status URL
     plot_names = request.form.getlist('plot_options')
+    job_id = submit_report(selection.charts(plot_names), selection.summary_stats)
 
-    if 'session_time_over_time' in plot_names:
-        fig1 = px.line(df, x='Created At', y='Time', title='Session Time Over Time')
-        fig1.update_layout(xaxis_title='Date', yaxis_title='Session Time (minutes)', xaxis=dict(tickangle=45))
-        plots.append(fig1)
-
-    if 'goal_distribution' in plot_names:
-        fig2 = px.histogram(df, x='Goal', title='Goal Distribution')
-        fig2.update_layout(xaxis_title='Goal', yaxis_title='Count', xaxis=dict(tickangle=45))
-        plots.append(fig2)
-
-    if 'session_duration_distribution' in plot_names:
-        fig3 = px.histogram(df, x='Time', nbins=20, title='Session Duration Distribution')
-        fig3.update_layout(xaxis_title='Session Duration (minutes)', yaxis_title='Frequency')
-        plots.append(fig3)
-
-    if 'elapsed_time_by_goal' in plot_names:
-        fig4 = px.bar(df_filtered, x='Goal', y='Elapsed', title='Total Elapsed Time by Goal (Excluding 60-min Sessions)', 
-                      labels={'Elapsed':'Total Elapsed Time (minutes)'})
-        fig4.update_layout(xaxis=dict(tickangle=45))
-        plots.append(fig4)
-
-    if 'session_time_vs_elapsed' in plot_names:
-        fig5 = px.scatter(df_filtered, x='Time', y='Elapsed', title='Session Time vs Elapsed Time (Excluding 60-min Sessions)')
-        fig5.update_layout(xaxis_title='Session Time (minutes)', yaxis_title='Elapsed Time (minutes)')
-        plots.append(fig5)
-
-    if 'average_elapsed_time' in plot_names:
-        fig6 = px.line(df_filtered, x='Created At', y='Elapsed', title='Average Elapsed Time per Session Over Time (Excluding 60-min Sessions)')
-        fig6.update_layout(xaxis_title='Date', yaxis_title='Average Elapsed Time (minutes)', xaxis=dict(tickangle=45))
-        plots.append(fig6)
-
-    if 'sessions_over_time' in plot_names:
-        sessions_over_time = df.groupby(df['Created At'].dt.date).size()
-        fig7 = px.line(sessions_over_time, title='Number of Sessions Over Time')
-        fig7.update_layout(xaxis_title='Date', yaxis_title='Number of Sessions', xaxis=dict(tickangle=45))
-        plots.append(fig7)
-
-    if 'total_elapsed_time_over_time' in plot_names:
-        total_elapsed_over_time = df_filtered.groupby(df_filtered['Created At'].dt.date)['Elapsed'].sum()
-        fig8 = px.line(total_elapsed_over_time, title='Total Elapsed Time Over Time (Excluding 60-min Sessions)')
-        fig8.update_layout(xaxis_title='Date', yaxis_title='Total Elapsed Time (minutes)', xaxis=dict(tickangle=45))
-        plots.append(fig8)
-
-    pdf = create_pdf_report(plots, summary_stats)
-    
-    pdf_output = BytesIO()
-    pdf.output(pdf_output)
-    pdf_output.seek(0)
-
-    return send_file(pdf_output, attachment_filename='arcade_sessions_report.pdf', as_attachment=True)
+    return jsonify({
+        'job_id': job_id,
+        'status_url': url_for('report_job_status', job_id=job_id),
+        'download_url': url_for('download_report', job_id=job_id)
+    }), 202
+
+@app.route('/datasets/memory')
+def dataset_memory():
+    # Resident size of every loaded dataset, per column and per built index
+    if session.get('role') != 'admin':
+        abort(403)
+    return jsonify(memory_reports())
+
+@app.route('/reports/<job_id>')
+def report_job_status(job_id):
+    status = report_status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown report'}), 404
+    return jsonify(status)
+
+@app.route('/reports/<job_id>/download')
+def download_report(job_id):
+    status = report_status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown report'}), 404
+    if status['status'] != 'done':
+        return jsonify(status), 409
+    return send_file(os.path.abspath(report_path(job_id)), mimetype='application/pdf', as_attachment=True,
+                     download_name='arcade_sessions_report.pdf')
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -355,10 +318,65 @@ def upload_file():
     file = request.files['file']
     if file.filename == '':
         return redirect(request.url)
-    if file and allowed_file(file.filename):
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], CSV_FILE_PATH))
-        return redirect(url_for('index'))
-    return redirect(url_for('index'))
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'Only .csv files can be uploaded'}), 400
+
+    # The file is copied aside here; validation and the swap into place run in the
+    # background, so the request returns as soon as the upload is on disk
+    if app.config['SESSION_STORE']:
+        # Replaces the uploader's own sessions only
+        sessions = user_sessions()
+        upload_path = save_upload(file.stream, app.config['SESSION_STORE'])
+        job_id = submit_ingest(ingest_store, upload_path, sessions.store, sessions.user_id)
+    else:
+        upload_path = save_upload(file.stream, CSV_FILE_PATH)
+        job_id = submit_ingest(ingest_csv, upload_path, CSV_FILE_PATH)
+    return jsonify({'job_id': job_id, 'status_url': url_for('upload_status', job_id=job_id)}), 202
+
+@app.errorhandler(413)
+def upload_too_large(error):
+    return jsonify({'error': f"Uploads are limited to {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MiB"}), 413
+
+@app.route('/uploads/<job_id>')
+def upload_status(job_id):
+    status = ingest_status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    return jsonify(status)
+
+# Latency histograms and /metrics; set PROFILE_SLOW_REQUESTS to sample slow requests' stacks.
+# /metrics is for admins, or for a scraper given METRICS_TOKEN as its bearer token.
+metrics.init_app(app, is_admin=lambda: session.get('role') == 'admin')
+FIGURE_CACHE_COUNTERS = {'hits', 'misses', 'evictions'}
+metrics.add_collector(lambda: [
+    (f'arcade_figure_cache_{name}_total', 'counter', f'Rendered figure cache {name}.', value)
+    if name in FIGURE_CACHE_COUNTERS else
+    (f'arcade_figure_cache_{name}', 'gauge', f'Rendered figure cache {name}.', value)
+    for name, value in figure_cache.stats().items()
+])
+
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_MIMETYPES = {'application/json', 'text/html', 'text/csv'}
+
+@app.after_request
+def compress_response(response):
+    if (response.is_streamed or response.direct_passthrough or response.status_code != 200
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    accept_encoding = request.headers.get('Accept-Encoding', '')
+    if brotli is not None and 'br' in accept_encoding:
+        encoding, compress = 'br', lambda data: brotli.compress(data, quality=5)
+    elif 'gzip' in accept_encoding:
+        encoding, compress = 'gzip', lambda data: gzip.compress(data, compresslevel=6)
+    else:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(compress(data))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,106 @@
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+matplotlib.use('Agg')
+
+from analytics import CHARTS, Selection, to_matplotlib
+from dataset import invalidate, load_dataset
+from reports import create_pdf_report
+
+INPUT_DIR = 'sessions'
+OUTPUT_DIR = 'user_reports'
+PNG_DPI = 100
+
+
+def report_is_current(csv_path, pdf_path):
+    try:
+        return os.path.getmtime(pdf_path) >= os.path.getmtime(csv_path)
+    except OSError:
+        return False
+
+def render_user_report(csv_path, output_dir, names, formats):
+    # Runs in a worker process: one user's CSV in, their PNGs and/or PDF out
+    started = time.perf_counter()
+    user_id = os.path.splitext(os.path.basename(csv_path))[0]
+    user_dir = os.path.join(output_dir, user_id)
+    os.makedirs(user_dir, exist_ok=True)
+
+    # Not through analytics.select: its cache would keep every user's dataset alive
+    selection = Selection(load_dataset(csv_path))
+    images = []
+    for chart in selection.charts(names):
+        image_path = os.path.join(user_dir, f'{chart.name}.png')
+        to_matplotlib(chart).savefig(image_path, dpi=PNG_DPI)
+        images.append(image_path)
+
+    if 'pdf' in formats:
+        pdf_path = os.path.join(user_dir, 'report.pdf')
+        tmp_path = pdf_path + '.tmp'
+        create_pdf_report(images, selection.summary_stats).output(tmp_path)
+        os.replace(tmp_path, pdf_path)
+    if 'png' not in formats:
+        for image_path in images:
+            os.remove(image_path)
+
+    # Workers go through many users; drop the loader's reference too, so this one's
+    # dataset is freed once the selection goes out of scope
+    invalidate(csv_path)
+    return user_id, selection.summary_stats['total_sessions'], time.perf_counter() - started
+
+def render_reports(csv_paths, output_dir=OUTPUT_DIR, names=tuple(CHARTS), formats=('pdf',), max_workers=None):
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(render_user_report, csv_path, output_dir, list(names), formats): csv_path
+            for csv_path in csv_paths
+        }
+        for future in as_completed(futures):
+            csv_path = futures[future]
+            try:
+                user_id, sessions, seconds = future.result()
+                print(f"{user_id}: {sessions} sessions in {seconds:.2f} s")
+                results[csv_path] = seconds
+            except Exception as e:
+                print(f"Failed to render report for {csv_path}: {e}")
+                results[csv_path] = None
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Render session reports for every per-user CSV in a directory')
+    parser.add_argument('input_dir', nargs='?', default=INPUT_DIR, help='directory of <user>.csv files')
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help='reports are written to <output-dir>/<user>/')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--format', choices=['pdf', 'png', 'both'], default='pdf')
+    parser.add_argument('--charts', nargs='+', choices=list(CHARTS), default=list(CHARTS),
+                        help='charts to include (default: all)')
+    parser.add_argument('--force', action='store_true',
+                        help='re-render reports that are already newer than their CSV')
+    args = parser.parse_args()
+
+    formats = ('pdf', 'png') if args.format == 'both' else (args.format,)
+    csv_paths = sorted(glob.glob(os.path.join(args.input_dir, '*.csv')))
+    if not args.force and 'pdf' in formats:
+        # Scheduled runs only redo users whose sessions changed since their last report
+        csv_paths = [
+            csv_path for csv_path in csv_paths
+            if not report_is_current(csv_path, os.path.join(
+                args.output_dir, os.path.splitext(os.path.basename(csv_path))[0], 'report.pdf'))
+        ]
+    if not csv_paths:
+        print(f"No reports to render in {args.input_dir}")
+        return
+
+    started = time.perf_counter()
+    results = render_reports(csv_paths, args.output_dir, args.charts, formats, args.workers)
+    failed = [csv_path for csv_path, seconds in results.items() if seconds is None]
+    print(f"Rendered {len(results) - len(failed)} of {len(results)} reports into {args.output_dir} "
+          f"in {time.perf_counter() - started:.1f} s")
+    if failed:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
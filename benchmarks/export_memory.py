@@ -0,0 +1,72 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import export
+from dataset import load_dataset, write_snapshot
+from rss import PeakMemory
+from synthetic import generate_sessions, write_csv
+
+
+def run_mode(mode, csv_path):
+    df = load_dataset(csv_path).df
+    memory = PeakMemory()
+    memory.start()
+    started = time.perf_counter()
+    written = 0
+    if mode == 'csv_buffered':
+        # The obvious implementation: render the whole file, then send it
+        written = len(df.to_csv(index=False, date_format=export.EXPORT_DATE_FORMAT).encode())
+    elif mode == 'csv_streaming':
+        written = sum(len(chunk) for chunk in export.iter_csv(df))
+    elif mode == 'excel_streaming':
+        written = sum(len(chunk) for chunk in export.iter_excel(df))
+    elapsed = time.perf_counter() - started
+    print(json.dumps({'mode': mode, 'seconds': elapsed, 'bytes': written, 'peak_rss_mb': memory.peak_mb(),
+                      'export_rss_mb': memory.growth_mb()}))
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description='Throughput and peak memory of /export_data on a large dataset')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--skip-excel', action='store_true')
+    parser.add_argument('--mode', choices=['baseline', 'csv_buffered', 'csv_streaming', 'excel_streaming'],
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--csv', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.csv)
+        return
+
+    modes = ['baseline', 'csv_buffered', 'csv_streaming']
+    if not args.skip_excel and export.xlsxwriter is not None:
+        modes.append('excel_streaming')
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, 'arcade_sessions.csv')
+        write_csv(generate_sessions(args.rows), csv_path)
+        # Modes load the typed snapshot, as the app does, so parsing doesn't dominate peak memory
+        write_snapshot(csv_path)
+        print(f"{args.rows} rows, source CSV {os.path.getsize(csv_path) / 2**20:.1f} MiB")
+        # Each mode runs in a fresh interpreter; "export" is peak RSS growth after the dataset is loaded
+        for mode in modes:
+            output = subprocess.run(
+                [sys.executable, __file__, '--mode', mode, '--csv', csv_path],
+                check=True, capture_output=True, text=True,
+            ).stdout.strip().splitlines()[-1]
+            result = json.loads(output)
+            if result['bytes']:
+                throughput = (f"{result['bytes'] / 2**20 / result['seconds']:8.1f} MiB/s  "
+                              f"{args.rows / result['seconds']:>12,.0f} rows/s")
+            else:
+                throughput = ' ' * 34
+            print(f"{mode:>16}: {result['seconds']:8.2f} s  {throughput}  peak RSS {result['peak_rss_mb']:8.1f} MiB  "
+                  f"export {result['export_rss_mb']:+8.1f} MiB")
+
+if __name__ == '__main__':
+    main_benchmark()
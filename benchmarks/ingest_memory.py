@@ -0,0 +1,85 @@
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+GOALS = ['No Goal', 'stm32 bad usb', 'arcade dashboard', 'pcb design', 'website']
+
+
+def make_session(i, start=datetime(2022, 1, 1, tzinfo=timezone.utc)):
+    created_at = start + timedelta(minutes=37 * i)
+    return {
+        'createdAt': created_at.isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+        'time': 60,
+        'elapsed': i % 61,
+        'goal': GOALS[i % len(GOALS)],
+        'ended': True,
+        'work': f'synthetic session {i} working on {GOALS[i % len(GOALS)]}',
+    }
+
+def write_payload(path, sessions, shuffle=False):
+    order = list(range(sessions))
+    if shuffle:
+        random.Random(0).shuffle(order)
+    with open(path, 'w') as file:
+        file.write('{"ok": true, "data": [')
+        for n, i in enumerate(order):
+            if n:
+                file.write(',')
+            json.dump(make_session(i), file)
+        file.write(']}')
+
+def run_mode(mode, payload_path, output_path):
+    started = time.perf_counter()
+    if mode == 'buffered':
+        # What fetch_sessions + write_to_csv do with response.json()
+        with open(payload_path, 'rb') as file:
+            sessions = json.load(file).get('data', [])
+        main.write_to_csv(sessions, output_path)
+    elif mode == 'streaming':
+        with open(payload_path, 'rb') as file:
+            chunks = iter(lambda: file.read(main.STREAM_CHUNK_SIZE), b'')
+            main.write_sessions_streaming(main.iter_sessions(chunks), output_path)
+    elapsed = time.perf_counter() - started
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({'mode': mode, 'seconds': elapsed, 'peak_rss_mb': peak_rss_mb}))
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description='Compare peak memory of buffered and streaming session ingest')
+    parser.add_argument('--sessions', type=int, default=1_000_000)
+    parser.add_argument('--shuffle', action='store_true', help='emit sessions out of order to exercise the merge')
+    parser.add_argument('--mode', choices=['baseline', 'buffered', 'streaming'], help=argparse.SUPPRESS)
+    parser.add_argument('--payload', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.payload, args.output)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        payload_path = os.path.join(directory, 'payload.json')
+        write_payload(payload_path, args.sessions, args.shuffle)
+        print(f"{args.sessions} sessions, payload {os.path.getsize(payload_path) / 2**20:.1f} MiB")
+        # Each mode runs in a fresh interpreter so peak RSS is not shared between them
+        for mode in ('baseline', 'buffered', 'streaming'):
+            output = subprocess.run(
+                [sys.executable, __file__, '--mode', mode, '--payload', payload_path,
+                 '--output', os.path.join(directory, f'{mode}.csv')],
+                check=True, capture_output=True, text=True,
+            ).stdout.strip().splitlines()[-1]
+            result = json.loads(output)
+            print(f"{mode:>10}: {result['seconds']:8.2f} s  peak RSS {result['peak_rss_mb']:8.1f} MiB")
+
+if __name__ == '__main__':
+    main_benchmark()
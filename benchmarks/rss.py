@@ -0,0 +1,35 @@
+import resource
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def status_mb(field):
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+    return None
+
+def reset_peak_rss():
+    # Loading the dataset peaks well above what most measured steps need; on Linux
+    # the high-water mark can be reset so a step's own peak becomes visible
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+class PeakMemory:
+    # Peak resident memory above the level at start(); falls back to the process
+    # lifetime peak where the high-water mark can't be reset
+    def start(self):
+        self.reset = reset_peak_rss()
+        self.base_mb = status_mb('VmRSS') if self.reset else peak_rss_mb()
+
+    def peak_mb(self):
+        return status_mb('VmHWM') if self.reset else peak_rss_mb()
+
+    def growth_mb(self):
+        return self.peak_mb() - self.base_mb
@@ -0,0 +1,344 @@
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from analytics import (CHARTS, MAX_POINTS_PER_CHART, Selection, downsample, render_html, render_spec, summary_stats,
+                       to_matplotlib)
+from dataset import Dataset, _parse_csv, invalidate, load_dataset, preprocess_data, read_csv, write_snapshot
+from export import iter_csv
+from reports import create_pdf_report
+from rss import PeakMemory
+from synthetic import (DEFAULT_DAYS, DEFAULT_GOALS, DEFAULT_WORK_WORDS, VOCABULARY, api_sessions, generate_sessions,
+                       write_csv)
+
+# Benchmarks for the ingest, filter, search, chart and report paths at several
+# dataset sizes. Every case runs in its own interpreter so peak memory is its own;
+# results are stored as JSON and can be compared against an earlier run.
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, 'results')
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+DEFAULT_REPEAT = 3
+DEFAULT_DATA_OPTIONS = {'goals': DEFAULT_GOALS, 'days': DEFAULT_DAYS, 'work_words': DEFAULT_WORK_WORDS}
+REGRESSION_THRESHOLD = 0.10
+# Differences below this are timer noise, whatever the ratio
+MIN_SIGNIFICANT_SECONDS = 0.005
+
+CASES = OrderedDict()
+
+
+class Skip(Exception):
+    pass
+
+
+def case(name):
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+class Context:
+    def __init__(self, data_dir, data_options):
+        self.data_dir = data_dir
+        self.csv_path = os.path.join(data_dir, 'arcade_sessions.csv')
+        # The generate_sessions options the data was made with
+        self.data_options = data_options
+
+    @property
+    def dataset(self):
+        return load_dataset(self.csv_path)
+
+    def output_path(self, name):
+        return os.path.join(self.data_dir, f'out-{os.getpid()}-{name}')
+
+
+@case('read_csv+preprocess')
+def _read_csv_preprocess(ctx):
+    # Parsing the CSV itself, bypassing the typed snapshot
+    return lambda: preprocess_data(_parse_csv(ctx.csv_path))
+
+@case('read_snapshot+preprocess')
+def _read_snapshot_preprocess(ctx):
+    return lambda: preprocess_data(read_csv(ctx.csv_path))
+
+@case('load_dataset')
+def _load_dataset(ctx):
+    def run():
+        invalidate(ctx.csv_path)
+        return load_dataset(ctx.csv_path)
+    return run
+
+@case('load_dataset (compact)')
+def _load_dataset_compact(ctx):
+    def run():
+        invalidate(ctx.csv_path)
+        return load_dataset(ctx.csv_path, compact=True)
+    return run
+
+@case('build_indexes')
+def _build_indexes(ctx):
+    df = ctx.dataset.df
+    def run():
+        dataset = Dataset(df, 0)
+        return dataset.goal_rows, dataset.time_order, dataset.search_text, dataset.word_index, dataset.goal_daily
+    return run
+
+# The filter and search cases time the row positions of a fresh Selection, as /filter
+# computes them on a cache miss; the names are kept so earlier results still compare
+
+@case('filter_by_date')
+def _filter_by_date(ctx):
+    dataset = ctx.dataset
+    created_at = dataset.df['Created At']
+    start = created_at.quantile(0.35).strftime('%Y-%m-%d')
+    end = created_at.quantile(0.65).strftime('%Y-%m-%d')
+    return lambda: Selection(dataset, start, end).rows
+
+@case('filter_by_goal')
+def _filter_by_goal(ctx):
+    dataset = ctx.dataset
+    goals = list(dataset.df['Goal'].value_counts().index[1:3])
+    dataset.rows_with_goals(goals)
+    return lambda: Selection(dataset, goals=goals).rows
+
+@case('filter_sessions')
+def _filter_sessions(ctx):
+    dataset = ctx.dataset
+    dataset.rows_excluding_60_min
+    return lambda: Selection(dataset).rows_filtered
+
+@case('search_data')
+def _search_data(ctx):
+    # A different word each call, more than the mask cache holds, so every call scans
+    dataset = ctx.dataset
+    dataset.search_text
+    words = iter(VOCABULARY * 1000)
+    return lambda: Selection(dataset, search_query=next(words)).rows
+
+@case('search_data (no index)')
+def _search_data_no_index(ctx):
+    # A new Dataset each call, so the search text is built as part of the search
+    df = ctx.dataset.df
+    return lambda: Selection(Dataset(df, 0), search_query='firmware').rows
+
+@case('search_words')
+def _search_words(ctx):
+    dataset = ctx.dataset
+    dataset.word_index
+    words = iter(VOCABULARY * 1000)
+    return lambda: Selection(dataset, search_query=f'{next(words)} {next(words)}', search_mode='words').rows
+
+@case('summary_stats')
+def _summary_stats(ctx):
+    df = ctx.dataset.df
+    return lambda: summary_stats(df)
+
+def _chart_case(name, render):
+    def setup(ctx):
+        dataset = ctx.dataset
+        # A fresh Selection per call, so filtering and aggregation are measured
+        # along with the chart as /filter does on a cache miss
+        return lambda: render(downsample(CHARTS[name](Selection(dataset)), MAX_POINTS_PER_CHART))
+    return setup
+
+for _name in CHARTS:
+    case(f'filter_data:{_name}:html')(_chart_case(_name, render_html))
+    case(f'filter_data:{_name}:spec')(_chart_case(_name, render_spec))
+
+def _report_charts(ctx):
+    selection = Selection(ctx.dataset)
+    return selection, [downsample(CHARTS[name](selection), MAX_POINTS_PER_CHART) for name in CHARTS]
+
+@case('rasterize:matplotlib')
+def _rasterize_matplotlib(ctx):
+    _, charts = _report_charts(ctx)
+    return lambda: [to_matplotlib(chart).savefig(ctx.output_path(f'{chart.name}.png')) for chart in charts]
+
+@case('rasterize:kaleido')
+def _rasterize_kaleido(ctx):
+    import plotly.io as pio
+    from analytics import to_plotly
+    _, charts = _report_charts(ctx)
+    try:
+        pio.to_image(to_plotly(charts[0]), format='png')
+    except Exception as e:
+        raise Skip(f'image export unavailable: {str(e).strip().splitlines()[0]}')
+    return lambda: [pio.to_image(to_plotly(chart), format='png') for chart in charts]
+
+@case('create_pdf_report')
+def _create_pdf_report(ctx):
+    # PDF assembly from already rasterized charts
+    selection, charts = _report_charts(ctx)
+    images = []
+    for chart in charts:
+        images.append(ctx.output_path(f'{chart.name}.png'))
+        to_matplotlib(chart).savefig(images[-1])
+    stats = selection.summary_stats
+    return lambda: create_pdf_report(images, stats).output(ctx.output_path('report.pdf'))
+
+@case('main.write_to_csv')
+def _write_to_csv(ctx):
+    sessions = api_sessions(ctx.dataset.df)
+    return lambda: main.write_to_csv(list(sessions), ctx.output_path('write_to_csv.csv'))
+
+@case('main.write_sessions_streaming')
+def _write_sessions_streaming(ctx):
+    sessions = api_sessions(ctx.dataset.df)
+    return lambda: main.write_sessions_streaming(iter(sessions), ctx.output_path('streaming.csv'))
+
+@case('export_csv')
+def _export_csv(ctx):
+    df = ctx.dataset.df
+    return lambda: sum(len(chunk) for chunk in iter_csv(df))
+
+
+def run_case(name, data_dir, repeat, data_options):
+    ctx = Context(data_dir, data_options)
+    try:
+        run = CASES[name](ctx)
+    except Skip as e:
+        return {'skipped': str(e)}
+    memory = PeakMemory()
+    memory.start()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    return {
+        'seconds': timings,
+        'min_seconds': min(timings),
+        'median_seconds': statistics.median(timings),
+        'peak_rss_mb': memory.peak_mb(),
+        'peak_growth_mb': memory.growth_mb(),
+    }
+
+def prepare_data(data_dir, rows, data_options):
+    # The CSV plus a fresh typed snapshot beside it, as the app would have after ingest
+    csv_path = os.path.join(data_dir, 'arcade_sessions.csv')
+    write_csv(generate_sessions(rows, **data_options), csv_path)
+    write_snapshot(csv_path)
+    return csv_path
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_DIR, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    regressions = []
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'} ({baseline.get('created')}):")
+    for key, result in results.items():
+        before = baseline['results'].get(key)
+        if not before or 'median_seconds' not in before or 'median_seconds' not in result:
+            continue
+        ratio = result['median_seconds'] / before['median_seconds'] if before['median_seconds'] else float('inf')
+        flag = ''
+        if abs(result['median_seconds'] - before['median_seconds']) < MIN_SIGNIFICANT_SECONDS:
+            pass
+        elif ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        elif ratio < 1 - threshold:
+            flag = '  faster'
+        print(f"{key:<64}{before['median_seconds']:10.4f} s -> {result['median_seconds']:10.4f} s  "
+              f"x{ratio:5.2f}{flag}")
+    return regressions
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description='Benchmark ingest, filtering, search, charts and reports')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='dataset sizes in rows')
+    parser.add_argument('--cases', nargs='+', default=['*'], help='case name patterns, e.g. "filter_*"')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--goals', type=int, default=DEFAULT_GOALS, help='distinct goals in the synthetic data')
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help='days the synthetic sessions span')
+    parser.add_argument('--work-words', type=int, default=DEFAULT_WORK_WORDS,
+                        help='words in each synthetic Work description')
+    parser.add_argument('--output', help='results file (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='relative slowdown reported as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--list', action='store_true', help='list case names and exit')
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    parser.add_argument('--data', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.list:
+        print('\n'.join(CASES))
+        return
+    data_options = {'goals': args.goals, 'days': args.days, 'work_words': args.work_words}
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.data, args.repeat, data_options)))
+        return
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        # Results from before these options were recorded used the defaults
+        baseline_options = baseline.get('data', DEFAULT_DATA_OPTIONS)
+        if baseline_options != data_options:
+            raise SystemExit(f"{args.compare} was run on data generated with {baseline_options}, "
+                             f"not {data_options}; pass the same --goals, --days and --work-words")
+
+    names = [name for name in CASES if any(fnmatch.fnmatch(name, pattern) for pattern in args.cases)]
+    results = OrderedDict()
+    for rows in args.sizes:
+        with tempfile.TemporaryDirectory() as data_dir:
+            started = time.perf_counter()
+            prepare_data(data_dir, rows, data_options)
+            print(f"{rows:,} rows (generated in {time.perf_counter() - started:.1f} s)")
+            for name in names:
+                process = subprocess.run(
+                    [sys.executable, __file__, '--run-case', name, '--data', data_dir, '--repeat', str(args.repeat),
+                     '--goals', str(args.goals), '--days', str(args.days), '--work-words', str(args.work_words)],
+                    capture_output=True, text=True,
+                )
+                key = f'{name}@{rows}'
+                if process.returncode:
+                    error = (process.stderr.strip().splitlines() or ['failed'])[-1]
+                    results[key] = {'error': error}
+                    print(f"  {name:<56} failed: {error}")
+                    continue
+                result = json.loads(process.stdout.strip().splitlines()[-1])
+                results[key] = result
+                if 'skipped' in result:
+                    print(f"  {name:<56} skipped: {result['skipped']}")
+                else:
+                    print(f"  {name:<56}{result['median_seconds']:10.4f} s  "
+                          f"peak RSS {result['peak_rss_mb']:8.1f} MiB ({result['peak_growth_mb']:+.1f})")
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump({
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'data': data_options,
+            'results': results,
+        }, file, indent=2)
+    print(f"\nResults written to {output}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions and args.fail_on_regression:
+            raise SystemExit(1)
+
+if __name__ == '__main__':
+    main_benchmark()
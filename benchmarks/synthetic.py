@@ -0,0 +1,63 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from export import iter_csv
+
+DEFAULT_GOALS = 20
+DEFAULT_DAYS = 365
+DEFAULT_WORK_WORDS = 6
+VOCABULARY = (
+    'pcb design firmware website api dashboard arcade stm32 usb iris tracking music game portfolio '
+    'bin sensor robot shader parser compiler keyboard badge ui layout debug refactor test deploy docs '
+    'server client database cache queue render plot chart export import upload login report'
+).split()
+
+
+def goal_names(goals=DEFAULT_GOALS):
+    return ['No Goal'] + [f'project {i}' for i in range(1, goals)]
+
+def generate_sessions(rows, goals=DEFAULT_GOALS, days=DEFAULT_DAYS, work_words=DEFAULT_WORK_WORDS, seed=0,
+                      start='2023-01-01'):
+    # Shaped like the API's history: mostly full 60-minute sessions, a skewed goal
+    # mix (a few goals get most sessions) and short free-text Work descriptions
+    rng = np.random.default_rng(seed)
+    offsets = np.sort(rng.integers(0, days * 86_400_000, rows))
+    created_at = pd.Timestamp(start, tz='UTC') + pd.to_timedelta(offsets, unit='ms')
+    time = np.where(rng.random(rows) < 0.6, 60, rng.integers(1, 60, rows))
+    elapsed = np.minimum(time, rng.integers(0, 61, rows))
+    names = np.array(goal_names(goals))
+    weights = 1 / np.arange(1, len(names) + 1)
+    goal = names[rng.choice(len(names), rows, p=weights / weights.sum())]
+    words = rng.choice(VOCABULARY, (rows, max(work_words, 1)))
+    work = pd.Series(words[:, 0]).str.cat([pd.Series(words[:, i]) for i in range(1, words.shape[1])], sep=' ')
+    return pd.DataFrame({
+        'Created At': created_at,
+        'Time': time,
+        'Elapsed': elapsed,
+        'Goal': goal,
+        'Ended': rng.random(rows) < 0.97,
+        'Work': work,
+    })
+
+def write_csv(df, path):
+    with open(path, 'wb') as file:
+        for chunk in iter_csv(df):
+            file.write(chunk)
+    return path
+
+def api_sessions(df):
+    # The same sessions as the history endpoint returns them, for main.py's writers
+    sessions = pd.DataFrame({
+        'createdAt': df['Created At'].dt.strftime('%Y-%m-%dT%H:%M:%S.%f').str[:-3] + 'Z',
+        'time': df['Time'],
+        'elapsed': df['Elapsed'],
+        'goal': df['Goal'],
+        'ended': df['Ended'],
+        'work': df['Work'],
+    })
+    return sessions.to_dict(orient='records')
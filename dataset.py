@@ -0,0 +1,477 @@
+import hashlib
+import io
+import itertools
+import os
+import sys
+import threading
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from metrics import stage, timed
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+CSV_FILE_PATH = 'arcade_sessions.csv'
+
+_datasets = {}
+_lock = threading.Lock()
+_versions = itertools.count(1)
+
+SEARCH_SEPARATOR = '\x1f'
+WORD_PATTERN = r'\w+'
+WORD_COLUMNS = ('Goal', 'Work')
+SEARCH_CACHE_SIZE = 16
+ROLLUP_COLUMNS = ['sessions', 'time', 'elapsed', 'sessions_excl_60', 'time_excl_60', 'elapsed_excl_60']
+TAIL_CHECK_BYTES = 64
+HEAD_CHECK_BYTES = 64 * 1024
+# Compact loads store Work as a categorical when values repeat at least this often on average
+COMPACT_WORK_REPEATS = 2
+
+
+def _text_column(series):
+    # str() on a million Timestamps is by far the slowest part of building the
+    # search text; numpy formats UTC datetimes an order of magnitude faster
+    if isinstance(series.dtype, pd.DatetimeTZDtype) and str(series.dt.tz) == 'UTC':
+        values = series.dt.tz_localize(None).to_numpy(dtype='datetime64[us]')
+        text = pd.Series(np.datetime_as_string(values, unit='us'), index=series.index, dtype=str)
+        return text.str.replace('T', ' ', regex=False) + '+00:00'
+    return series.astype(str)
+
+def build_search_text(df):
+    # One lowercased string per row, columns joined by a separator no query contains
+    columns = [_text_column(df[column]) for column in df.columns]
+    return columns[0].str.cat(columns[1:], sep=SEARCH_SEPARATOR, na_rep='').str.lower()
+
+def build_word_index(df, columns=WORD_COLUMNS):
+    rows = []
+    words = []
+    for column in columns:
+        exploded = df[column].astype(str).str.lower().str.findall(WORD_PATTERN).explode().dropna()
+        rows.append(exploded.index.to_numpy())
+        words.append(exploded.to_numpy(dtype=object))
+    rows = np.concatenate(rows)
+    codes, uniques = pd.factorize(np.concatenate(words))
+    order = np.argsort(codes, kind='stable')
+    bounds = np.cumsum(np.bincount(codes, minlength=len(uniques)))[:-1]
+    return {
+        word: np.unique(positions)
+        for word, positions in zip(uniques, np.split(rows[order], bounds))
+    }
+
+def build_daily_rollup(df):
+    # Per (day, goal) counts and sums, with the "excluding 60-min sessions" variants alongside.
+    # Days stay datetime64 (midnight UTC) instead of Python date objects.
+    full = df['Time'] == 60
+    rollup = pd.DataFrame({
+        'sessions': 1,
+        'time': df['Time'],
+        'elapsed': df['Elapsed'],
+        'sessions_excl_60': (~full).astype('int64'),
+        'time_excl_60': df['Time'].mask(full, 0),
+        'elapsed_excl_60': df['Elapsed'].mask(full, 0),
+    }, index=df.index)
+    keys = [df['Created At'].dt.floor('D').rename('Day'), df['Goal'].astype(str).rename('Goal')]
+    return rollup.groupby(keys, sort=True).sum()
+
+def merge_rollups(*rollups):
+    return pd.concat(rollups).groupby(level=['Day', 'Goal'], sort=True).sum()
+def with_daily_means(daily):
+    daily = daily.copy()
+    daily['mean_time'] = daily['time'] / daily['sessions']
+    daily['mean_elapsed'] = daily['elapsed'] / daily['sessions']
+    counted = daily['sessions_excl_60'].where(daily['sessions_excl_60'] > 0)
+    daily['mean_time_excl_60'] = daily['time_excl_60'] / counted
+    daily['mean_elapsed_excl_60'] = daily['elapsed_excl_60'] / counted
+    return daily
+
+
+class Dataset:
+    # source names what the data was loaded from; versions of the same source supersede each other
+    def __init__(self, df, version, goal_daily=None, source=None):
+        self.df = df
+        self.version = version
+        self.source = source
+        self._search_masks = {}
+        self._sort_orders = {}
+        self._sort_ranks = {}
+        self._column_texts = {}
+        self._goal_daily = goal_daily
+
+    @property
+    def goal_daily(self):
+        if self._goal_daily is None:
+            self._goal_daily = build_daily_rollup(self.df)
+        return self._goal_daily
+
+    @cached_property
+    def daily(self):
+        return self.goal_daily.groupby(level='Day').sum()
+
+    def append(self, new_df, version):
+        # Appended rows follow the existing column types (a compact load may have interned Work or not)
+        for column in self.df.columns:
+            if (isinstance(new_df[column].dtype, pd.CategoricalDtype)
+                    and not isinstance(self.df[column].dtype, pd.CategoricalDtype)):
+                new_df[column] = new_df[column].astype(self.df[column].dtype)
+        df = pd.concat([self.df, new_df], ignore_index=True)
+        for column in self.df.columns:
+            if isinstance(self.df[column].dtype, pd.CategoricalDtype):
+                df[column] = union_categoricals([self.df[column], new_df[column].astype('category')])
+        if not df['Created At'].is_monotonic_increasing:
+            df = df.sort_values('Created At', kind='stable', na_position='last', ignore_index=True)
+        # Only the appended rows are rolled up; existing days are merged, not recomputed
+        goal_daily = None
+        if self._goal_daily is not None:
+            goal_daily = merge_rollups(self._goal_daily, build_daily_rollup(new_df))
+        return Dataset(df, version, goal_daily, self.source)
+
+    def daily_totals(self, start=None, end=None, goals=None):
+        # Rollup rows for whole days inside [start, end], plus the raw rows of partially covered edge days.
+        # start and end must be in the column's timezone, as analytics._date_bound returns them.
+        created_at = self.df['Created At']
+        rollup = self.goal_daily
+        if goals:
+            rollup = rollup[rollup.index.get_level_values('Goal').isin(goals)]
+        days = rollup.index.get_level_values('Day')
+        whole_days = np.ones(len(rollup), dtype=bool)
+        edges = []
+        unit = pd.Timedelta(1, unit=created_at.dt.unit)
+        first_day = None
+        if start is not None:
+            first_day = start.ceil('D')
+            whole_days &= days >= first_day
+            edges.append((start, first_day - unit if end is None else min(first_day - unit, end)))
+        if end is not None:
+            end_day = (end + unit).floor('D')
+            whole_days &= days < end_day
+            edges.append((end_day if first_day is None else max(first_day, end_day), end))
+        parts = [rollup[whole_days]]
+        for lo, hi in edges:
+            if lo > hi:
+                continue
+            edge = self.df.iloc[created_at.searchsorted(lo):created_at.searchsorted(hi, side='right')]
+            if goals:
+                edge = edge[edge['Goal'].isin(goals)]
+            parts.append(build_daily_rollup(edge))
+        return with_daily_means(merge_rollups(*parts).groupby(level='Day').sum())
+
+    @cached_property
+    def search_text(self):
+        with stage('build_search_text'):
+            return build_search_text(self.df)
+
+    def search_mask(self, query):
+        # Boolean mask over all rows; dashboards repeat the same few queries, so keep recent ones
+        query = query.lower()
+        mask = self._search_masks.get(query)
+        if mask is None:
+            with stage('search_scan'):
+                mask = self.search_text.str.contains(query, regex=False).to_numpy()
+            self._search_masks[query] = mask
+            while len(self._search_masks) > SEARCH_CACHE_SIZE:
+                self._search_masks.pop(next(iter(self._search_masks)), None)
+        return mask
+
+    @cached_property
+    def word_index(self):
+        return build_word_index(self.df)
+
+    @cached_property
+    def goal_rows(self):
+        # goal -> sorted row positions
+        return self.df.groupby('Goal', observed=True, sort=False).indices
+
+    @cached_property
+    def time_order(self):
+        return np.argsort(self.df['Time'].to_numpy(), kind='stable')
+
+    @cached_property
+    def sorted_times(self):
+        return self.df['Time'].to_numpy()[self.time_order]
+
+    @cached_property
+    def rows_excluding_60_min(self):
+        lo = np.searchsorted(self.sorted_times, 60, side='left')
+        hi = np.searchsorted(self.sorted_times, 60, side='right')
+        return np.sort(np.concatenate([self.time_order[:lo], self.time_order[hi:]]))
+
+    def rows_with_goals(self, goals):
+        rows = [self.goal_rows[goal] for goal in dict.fromkeys(goals) if goal in self.goal_rows]
+        if not rows:
+            return np.empty(0, dtype=np.intp)
+        return np.sort(np.concatenate(rows))
+
+    def rows_with_time(self, min_time=None, max_time=None):
+        lo = 0 if min_time is None else np.searchsorted(self.sorted_times, min_time, side='left')
+        hi = len(self.sorted_times) if max_time is None else np.searchsorted(self.sorted_times, max_time, side='right')
+        return np.sort(self.time_order[lo:hi])
+
+    def sort_order(self, column):
+        # Row positions in ascending column order (ties keep row order, missing values last)
+        order = self._sort_orders.get(column)
+        if order is None:
+            if column == 'Created At':
+                order = np.arange(len(self.df))
+            elif column == 'Time':
+                order = self.time_order
+            else:
+                values = self.df[column]
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    values = values.cat.reorder_categories(sorted(values.cat.categories, key=str))
+                order = values.reset_index(drop=True).sort_values(kind='stable', na_position='last').index.to_numpy()
+            self._sort_orders[column] = order
+        return order
+
+    def sort_rank(self, column):
+        # Inverse of sort_order: rank[row] is the row's place in column order
+        rank = self._sort_ranks.get(column)
+        if rank is None:
+            rank = np.empty(len(self.df), dtype=np.intp)
+            rank[self.sort_order(column)] = np.arange(len(self.df))
+            self._sort_ranks[column] = rank
+        return rank
+
+    def column_text(self, column):
+        text = self._column_texts.get(column)
+        if text is None:
+            text = _text_column(self.df[column]).str.lower()
+            self._column_texts[column] = text
+        return text
+
+    def rows_containing(self, column, value):
+        value = value.lower()
+        values = self.df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Match the few categories, then take their rows from the goal index
+            categories = values.cat.categories
+            matches = categories[categories.astype(str).str.lower().str.contains(value, regex=False)]
+            if column == 'Goal':
+                return self.rows_with_goals(matches)
+            return np.flatnonzero(values.isin(matches).to_numpy())
+        return np.flatnonzero(self.column_text(column).str.contains(value, regex=False).to_numpy())
+
+    def rows_in_range(self, column, low=None, high=None):
+        if column == 'Time':
+            return self.rows_with_time(low, high)
+        values = self.df[column].to_numpy()
+        mask = np.ones(len(values), dtype=bool)
+        if low is not None:
+            mask &= values >= low
+        if high is not None:
+            mask &= values <= high
+        return np.flatnonzero(mask)
+
+    def rows_with_words(self, query):
+        # Row positions whose Goal or Work contains every word of the query
+        rows = None
+        for word in pd.Series([query]).str.lower().str.findall(WORD_PATTERN)[0]:
+            positions = self.word_index.get(word)
+            if positions is None:
+                return np.empty(0, dtype=np.int64)
+            rows = positions if rows is None else np.intersect1d(rows, positions, assume_unique=True)
+        return rows if rows is not None else np.arange(len(self.df))
+
+    def memory_report(self):
+        # Bytes held by the frame, per column, and by whichever indexes have been built so far
+        columns = {
+            column: {'dtype': str(self.df[column].dtype),
+                     'bytes': int(self.df[column].memory_usage(index=False, deep=True))}
+            for column in self.df.columns
+        }
+        built = self.__dict__
+        indexes = {
+            'goal_daily': self._goal_daily,
+            'search_text': built.get('search_text'),
+            'search_masks': self._search_masks,
+            'word_index': built.get('word_index'),
+            'goal_rows': built.get('goal_rows'),
+            'time_order': built.get('time_order'),
+            'sorted_times': built.get('sorted_times'),
+            'rows_excluding_60_min': built.get('rows_excluding_60_min'),
+            'sort_orders': self._sort_orders,
+            'sort_ranks': self._sort_ranks,
+            'column_texts': self._column_texts,
+        }
+        indexes = {name: _nbytes(value) for name, value in indexes.items() if value is not None and len(value)}
+        frame_bytes = sum(column['bytes'] for column in columns.values())
+        return {
+            'version': self.version,
+            'rows': len(self.df),
+            'frame_bytes': frame_bytes,
+            'index_bytes': indexes,
+            'total_bytes': frame_bytes + sum(indexes.values()),
+            'columns': columns,
+        }
+
+
+def _nbytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, dict):
+        return sum(sys.getsizeof(key) + _nbytes(item) for key, item in value.items())
+    return int(getattr(value, 'nbytes', 0))
+
+
+def snapshot_path(file_path):
+    return os.path.splitext(file_path)[0] + '.feather'
+
+def _fresh_snapshot(file_path):
+    if feather is None:
+        return None
+    path = snapshot_path(file_path)
+    try:
+        if os.stat(path).st_mtime_ns >= os.stat(file_path).st_mtime_ns:
+            return path
+    except FileNotFoundError:
+        pass
+    return None
+
+def snapshot_is_fresh(file_path):
+    return _fresh_snapshot(file_path) is not None
+
+def _parse_csv(file_path):
+    return pd.read_csv(file_path, encoding='ISO-8859-1')
+
+def read_csv(file_path):
+    # Prefer the typed columnar snapshot written at ingest time; it is only
+    # trusted while it is at least as new as the CSV it was built from
+    snapshot = _fresh_snapshot(file_path)
+    if snapshot:
+        with stage('read_snapshot'):
+            return feather.read_table(snapshot, memory_map=True).to_pandas()
+    with stage('parse_csv'):
+        return _parse_csv(file_path)
+
+@timed('preprocess')
+def preprocess_data(df, compact=False):
+    df['Created At'] = pd.to_datetime(df['Created At'], errors='coerce')
+    df['Goal'] = df['Goal'].astype('category')
+    for column in ('Time', 'Elapsed'):
+        df[column] = pd.to_numeric(df[column], errors='coerce').fillna(0).astype('int64')
+    if compact:
+        df = compact_frame(df)
+    return df
+
+def compact_frame(df):
+    # Smallest dtypes that hold the data: minutes fit in int8/int16, Ended is a plain
+    # bool, and Work is interned as a categorical when descriptions repeat, else Arrow-backed
+    for column in ('Time', 'Elapsed'):
+        df[column] = pd.to_numeric(df[column], downcast='integer')
+    if 'Ended' in df.columns and df['Ended'].dtype != bool:
+        df['Ended'] = df['Ended'].astype(str).str.strip().str.lower().eq('true')
+    if 'Work' in df.columns and not isinstance(df['Work'].dtype, pd.CategoricalDtype):
+        if df['Work'].nunique() * COMPACT_WORK_REPEATS <= len(df):
+            df['Work'] = df['Work'].astype('category')
+        elif feather is not None:
+            df['Work'] = df['Work'].astype(pd.StringDtype('pyarrow'))
+    return df
+
+def write_snapshot(file_path, df=None):
+    if feather is None:
+        return None
+    if df is None:
+        df = preprocess_data(_parse_csv(file_path))
+    path = snapshot_path(file_path)
+    tmp_path = path + '.tmp'
+    # Uncompressed so readers can memory-map the columns directly
+    feather.write_feather(df, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+    return path
+
+def append_snapshot(file_path, rows):
+    # rows are in CSV column order; the existing snapshot is reused instead of re-parsing the CSV
+    if feather is None:
+        return None
+    path = snapshot_path(file_path)
+    if not os.path.exists(path):
+        return write_snapshot(file_path)
+    existing = feather.read_table(path, memory_map=True).to_pandas()
+    new_rows = pd.DataFrame(rows, columns=existing.columns)
+    df = pd.concat([existing, new_rows.astype({'Ended': bool})], ignore_index=True)
+    return write_snapshot(file_path, preprocess_data(df))
+
+def _file_key(path):
+    # A rewrite through os.replace (uploads, streamed syncs) changes the inode even at the same size
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size, stat.st_dev, stat.st_ino
+
+def _head_digest(file, size):
+    file.seek(0)
+    return hashlib.blake2b(file.read(min(size, HEAD_CHECK_BYTES))).digest()
+
+def _read_edges(path, size):
+    # Fingerprints of the start and end of the file as loaded, to tell an append from a rewrite
+    with open(path, 'rb') as file:
+        head = _head_digest(file, size)
+        file.seek(max(0, size - TAIL_CHECK_BYTES))
+        return head, file.read(size - max(0, size - TAIL_CHECK_BYTES))
+
+def _read_appended_rows(path, old_key, new_key, edges, dataset, compact=False):
+    # Parse only the bytes written since the last load, if the file was provably appended to:
+    # same file, same first bytes, the old last bytes still in place, and only sessions newer
+    # than every loaded one after them (the only rows main.py's incremental sync appends).
+    # Anything else is a rewrite and gets a full reload.
+    old_size, new_size = old_key[1], new_key[1]
+    head, tail = edges
+    if old_key[2:] != new_key[2:] or new_size <= old_size or not tail.endswith(b'\n'):
+        return None
+    with open(path, 'rb') as file:
+        if _head_digest(file, old_size) != head:
+            return None
+        file.seek(old_size - len(tail))
+        data = file.read(new_size - old_size + len(tail))
+    if not data.startswith(tail) or not data.endswith(b'\n'):
+        return None
+    rows = pd.read_csv(io.BytesIO(data[len(tail):]), header=None, names=dataset.df.columns, encoding='ISO-8859-1',
+                       dtype={'Goal': str, 'Work': str})
+    rows = preprocess_data(rows, compact)
+    last = dataset.df['Created At'].max()
+    created_at = rows['Created At']
+    if created_at.isna().any() or (pd.notna(last) and created_at.min() <= last):
+        return None
+    return rows
+
+def load_dataset(file_path=CSV_FILE_PATH, compact=False):
+    # The parsed frame is shared between requests and must be treated as read-only.
+    # compact selects the smaller dtypes of compact_frame; both variants are cached separately.
+    path = os.path.abspath(file_path)
+    key = _file_key(path)
+    with _lock:
+        cached = _datasets.get((path, compact))
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        new_rows = None
+        if cached is not None:
+            new_rows = _read_appended_rows(path, cached[0], key, cached[2], cached[1], compact)
+        if new_rows is not None:
+            with stage('append_rows'):
+                dataset = cached[1].append(new_rows, next(_versions))
+        else:
+            # Rows are kept in Created At order so date ranges are contiguous slices
+            df = preprocess_data(read_csv(path), compact)
+            with stage('sort_rows'):
+                df = df.sort_values('Created At', kind='stable', na_position='last', ignore_index=True)
+            dataset = Dataset(df, next(_versions), source=(path, compact))
+        _datasets[path, compact] = (key, dataset, _read_edges(path, key[1]))
+        return dataset
+
+def invalidate(file_path=CSV_FILE_PATH):
+    path = os.path.abspath(file_path)
+    with _lock:
+        for compact in (False, True):
+            _datasets.pop((path, compact), None)
+
+def memory_reports():
+    # Dataset.memory_report() for every loaded dataset, largest first
+    with _lock:
+        loaded = [(path, compact, cached[1]) for (path, compact), cached in _datasets.items()]
+    reports = [dict(path=path, compact=compact, **dataset.memory_report()) for path, compact, dataset in loaded]
+    return sorted(reports, key=lambda report: report['total_bytes'], reverse=True)
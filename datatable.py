@@ -0,0 +1,100 @@
+import numpy as np
+
+# Server-side processing for the DataTables session table: every draw request is
+# answered from the cached dataset's indexes and only the visible page is serialized
+
+TABLE_COLUMNS = ['Created At', 'Time', 'Elapsed', 'Goal', 'Ended', 'Work']
+NUMERIC_COLUMNS = {'Time', 'Elapsed'}
+DEFAULT_PAGE_LENGTH = 10
+MAX_PAGE_LENGTH = 1000
+
+
+def _int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+def parse_request(form):
+    columns = []
+    while 'columns[%d][data]' % len(columns) in form:
+        i = len(columns)
+        columns.append({
+            'data': form['columns[%d][data]' % i],
+            'search': form.get('columns[%d][search][value]' % i, ''),
+            'orderable': form.get('columns[%d][orderable]' % i, 'true') == 'true',
+        })
+    order = []
+    while 'order[%d][column]' % len(order) in form:
+        i = len(order)
+        order.append((_int(form['order[%d][column]' % i], -1), form.get('order[%d][dir]' % i) == 'desc'))
+    length = _int(form.get('length'), DEFAULT_PAGE_LENGTH)
+    if length < 0 or length > MAX_PAGE_LENGTH:
+        # -1 is DataTables for "all rows"; never send more than one bounded page
+        length = MAX_PAGE_LENGTH
+    return {
+        'draw': _int(form.get('draw'), 0),
+        'start': max(_int(form.get('start'), 0), 0),
+        'length': length,
+        'search': form.get('search[value]', ''),
+        'columns': columns,
+        'order': order,
+    }
+
+def parse_range(value):
+    # "5", "5-30" or "5 - 30"; either end may be left open ("-30", "5-")
+    low, sep, high = value.partition('-')
+    try:
+        low = float(low) if low.strip() else None
+        high = (float(high) if high.strip() else None) if sep else low
+    except ValueError:
+        return None
+    return low, high
+
+def _intersect(rows, other):
+    return other if rows is None else np.intersect1d(rows, other, assume_unique=True)
+
+def filter_rows(dataset, params, rows=None):
+    # Sorted row positions matching the global and per-column searches, or None for every row
+    if params['search']:
+        rows = _intersect(rows, np.flatnonzero(dataset.search_mask(params['search'])))
+    for column in params['columns']:
+        name, value = column['data'], column['search'].strip()
+        if not value or name not in dataset.df.columns:
+            continue
+        if name in NUMERIC_COLUMNS:
+            bounds = parse_range(value)
+            matched = dataset.rows_in_range(name, *bounds) if bounds else np.empty(0, dtype=np.intp)
+        else:
+            matched = dataset.rows_containing(name, value)
+        rows = _intersect(rows, matched)
+    return rows
+
+def _sort_column(dataset, params):
+    for index, descending in params['order']:
+        if 0 <= index < len(params['columns']):
+            column = params['columns'][index]
+            if column['orderable'] and column['data'] in dataset.df.columns:
+                return column['data'], descending
+    return 'Created At', False
+
+def page_rows(dataset, params, rows=None):
+    column, descending = _sort_column(dataset, params)
+    if rows is None:
+        # Unfiltered: the page is a slice of the cached column order
+        ordered = dataset.sort_order(column)
+    else:
+        ordered = rows[np.argsort(dataset.sort_rank(column)[rows], kind='stable')]
+    if descending:
+        ordered = ordered[::-1]
+    return ordered[params['start']:params['start'] + params['length']]
+
+def table_response(dataset, params, rows=None):
+    rows = filter_rows(dataset, params, rows)
+    total = len(dataset.df)
+    columns = [column for column in TABLE_COLUMNS if column in dataset.df.columns]
+    page = dataset.df.take(page_rows(dataset, params, rows))[columns]
+    # to_json encodes the page column-wise in C; the envelope is spliced around it
+    return '{"draw":%d,"recordsTotal":%d,"recordsFiltered":%d,"data":%s}' % (
+        params['draw'], total, total if rows is None else len(rows),
+        page.to_json(orient='records', date_format='iso'))
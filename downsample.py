@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+
+def _as_float(values):
+    if isinstance(values.dtype, pd.DatetimeTZDtype):
+        values = values.dt.tz_localize(None)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.to_numpy(dtype='datetime64[ns]').astype('int64').astype('float64')
+    return values.to_numpy(dtype='float64')
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: keeps the first and last point and, from each
+    # bucket in between, the point forming the largest triangle with its neighbours
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    every = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, dtype=np.intp)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+def downsample_line(df, x, y, max_points):
+    df = df[df[x].notna()]
+    if len(df) <= max_points:
+        return df
+    return df.iloc[lttb(_as_float(df[x]), _as_float(df[y]), max_points)]
+
+def bin_points(df, x, y, max_points, count='Sessions'):
+    # Collapse a scatter into at most max_points weighted points. Identical points are
+    # merged first (session minutes are integers, so this is often exact); only if that
+    # is still too many are they snapped to a grid of cell centres.
+    df = df[[x, y]].dropna()
+    points = df.groupby([x, y], sort=False).size()
+    if len(points) > max_points:
+        cells = max(int(np.sqrt(max_points)), 1)
+        x_edges = np.linspace(df[x].min(), df[x].max(), cells + 1)
+        y_edges = np.linspace(df[y].min(), df[y].max(), cells + 1)
+        counts, _, _ = np.histogram2d(df[x], df[y], bins=[x_edges, y_edges])
+        xi, yi = np.nonzero(counts)
+        return pd.DataFrame({
+            x: (x_edges[xi] + x_edges[xi + 1]) / 2,
+            y: (y_edges[yi] + y_edges[yi + 1]) / 2,
+            count: counts[xi, yi].astype('int64'),
+        })
+    return points.rename(count).reset_index()
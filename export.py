@@ -0,0 +1,111 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from metrics import stage
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+EXPORT_CHUNK_ROWS = 50_000
+EXPORT_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+EXCEL_DATE_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+FILE_CHUNK_SIZE = 256 * 1024
+# One header row plus data rows; Excel stops at 1,048,576
+EXCEL_MAX_ROWS = 1_048_575
+
+
+def _chunks(df, chunk_rows=EXPORT_CHUNK_ROWS):
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+def _utc_values(values):
+    # Naive UTC datetime64 values for a datetime column, or None for any other column
+    if isinstance(values.dtype, pd.DatetimeTZDtype):
+        values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.to_numpy(dtype='datetime64[ms]')
+    return None
+
+def _csv_chunk(chunk):
+    # strftime through date_format is the slowest part of to_csv; numpy formats
+    # the same ISO text (as the API sends it) an order of magnitude faster
+    chunk = chunk.copy(deep=False)
+    for name in chunk.columns:
+        values = _utc_values(chunk[name])
+        if values is not None:
+            text = np.char.add(np.datetime_as_string(values, unit='ms'), 'Z')
+            text[np.isnat(values)] = ''
+            chunk[name] = text
+    return chunk
+
+def iter_csv(df, chunk_rows=EXPORT_CHUNK_ROWS):
+    # Header, then one encoded block per chunk; only a chunk's text is ever held at once
+    yield ','.join(df.columns).encode() + b'\n'
+    for chunk in _chunks(df, chunk_rows):
+        with stage('export_csv_chunk'):
+            data = _csv_chunk(chunk).to_csv(header=False, index=False).encode()
+        yield data
+
+def _excel_columns(chunk, date_format):
+    # (write method name, values, format) per column, so each cell skips
+    # xlsxwriter's type sniffing; missing values come through as None and stay blank
+    columns = []
+    for name in chunk.columns:
+        values = chunk[name]
+        utc = _utc_values(values)
+        if utc is not None:
+            # Excel stores datetimes as days since 1899-12-30
+            days = (utc - np.datetime64('1899-12-30', 'ms')).astype('float64') / 86_400_000
+            days[np.isnat(utc)] = np.nan
+            columns.append(('write_number', pd.Series(days).astype(object).where(~np.isnan(days), None).tolist(),
+                            date_format))
+            continue
+        if pd.api.types.is_bool_dtype(values):
+            method = 'write_boolean'
+        elif pd.api.types.is_numeric_dtype(values):
+            method = 'write_number'
+        else:
+            method = 'write_string'
+            values = values.astype(object)
+        if values.hasnans:
+            values = values.astype(object).where(values.notna(), None)
+        columns.append((method, values.tolist(), None))
+    return columns
+
+def write_excel(df, path, chunk_rows=EXPORT_CHUNK_ROWS):
+    # constant_memory flushes each row to disk as soon as the next one starts,
+    # so memory stays flat no matter how many rows are written
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    date_format = workbook.add_format({'num_format': EXCEL_DATE_FORMAT})
+    worksheet = workbook.add_worksheet('Sessions')
+    worksheet.write_row(0, 0, list(df.columns))
+    row = 1
+    for chunk in _chunks(df, chunk_rows):
+        columns = _excel_columns(chunk, date_format)
+        writers = [(col, getattr(worksheet, method), cell_format)
+                   for col, (method, _, cell_format) in enumerate(columns)]
+        # Rows must be written in order: constant_memory discards a row once the next begins
+        for values in zip(*(values for _, values, _ in columns)):
+            for (col, write, cell_format), value in zip(writers, values):
+                if value is not None:
+                    write(row, col, value, cell_format)
+            row += 1
+    workbook.close()
+
+def iter_excel(df, chunk_rows=EXPORT_CHUNK_ROWS):
+    # An xlsx is a zip that is only complete once closed, so it is built in a
+    # temporary file (from the first iteration, after the headers are sent) and
+    # then streamed back from disk
+    handle, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(handle)
+    try:
+        write_excel(df, path, chunk_rows)
+        with open(path, 'rb') as file:
+            yield from iter(lambda: file.read(FILE_CHUNK_SIZE), b'')
+    finally:
+        os.remove(path)
@@ -0,0 +1,162 @@
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from dataset import invalidate, preprocess_data, snapshot_path, write_snapshot
+from metrics import stage
+
+# Uploaded session files are copied to a temp file beside the live CSV, validated
+# and typed chunk by chunk on a background thread, then swapped in with os.replace,
+# so readers see either the old file or the new one and never a partial write.
+
+CSV_COLUMNS = ['Created At', 'Time', 'Elapsed', 'Goal', 'Ended', 'Work']
+UPLOAD_CHUNK_ROWS = 100_000
+COPY_BUFFER_BYTES = 1024 * 1024
+MAX_UPLOAD_BYTES = 512 * 1024 * 1024
+MAX_REPORTED_ERRORS = 10
+INGEST_RETENTION_SECONDS = 60 * 60
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+BOOLEANS = {'true': True, 'false': False}
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+# One upload is applied at a time, so two swaps of the same file can't interleave
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ingest')
+
+
+class UploadError(ValueError):
+    pass
+
+
+def save_upload(stream, file_path):
+    # Same directory as the live file, so the final os.replace is atomic
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, path = tempfile.mkstemp(prefix='.' + os.path.basename(file_path) + '.', suffix='.upload', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            shutil.copyfileobj(stream, file, COPY_BUFFER_BYTES)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+def _chunk_errors(raw, typed, first_line):
+    # (line, column, value) for every value the typed chunk couldn't represent
+    invalid = {
+        'Created At': raw['Created At'].notna() & typed['Created At'].isna(),
+        'Time': pd.to_numeric(raw['Time'], errors='coerce').pipe(lambda n: n.isna() | (n < 0) | (n % 1 != 0)),
+        'Elapsed': pd.to_numeric(raw['Elapsed'], errors='coerce').pipe(lambda n: n.isna() | (n < 0) | (n % 1 != 0)),
+        'Ended': typed['Ended'].isna(),
+    }
+    errors = []
+    for column, mask in invalid.items():
+        for position in mask.to_numpy().nonzero()[0][:MAX_REPORTED_ERRORS]:
+            errors.append((first_line + position, column, raw[column].iloc[position]))
+    return sorted(errors)[:MAX_REPORTED_ERRORS]
+
+def read_upload(path, chunk_rows=UPLOAD_CHUNK_ROWS):
+    # The typed frame preprocess_data would produce, or UploadError naming the first bad values
+    chunks = []
+    first_line = 2
+    try:
+        reader = pd.read_csv(path, encoding='ISO-8859-1', dtype=str, chunksize=chunk_rows)
+        for raw in reader:
+            if list(raw.columns) != CSV_COLUMNS:
+                raise UploadError(f"Expected the columns {', '.join(CSV_COLUMNS)}; got {', '.join(raw.columns)}")
+            with stage('validate_upload'):
+                typed = raw.copy()
+                typed['Ended'] = raw['Ended'].str.strip().str.lower().map(BOOLEANS)
+                typed = preprocess_data(typed)
+                errors = _chunk_errors(raw, typed, first_line)
+            if errors:
+                raise UploadError('Invalid values: ' + '; '.join(
+                    f'line {line}, {column}: {value!r}' for line, column, value in errors))
+            typed['Ended'] = typed['Ended'].astype(bool)
+            chunks.append(typed)
+            first_line += len(raw)
+    except pd.errors.EmptyDataError:
+        raise UploadError('The file is empty')
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        raise UploadError(f'Not a readable CSV file: {e}')
+    if not chunks:
+        raise UploadError('The file has no sessions')
+    df = pd.concat(chunks, ignore_index=True)
+    df['Goal'] = union_categoricals([chunk['Goal'] for chunk in chunks])
+    return df
+
+def _discard(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def ingest_csv(upload_path, file_path):
+    # Replaces the live CSV and its typed snapshot; the new file gets a new dataset version.
+    # The new snapshot is staged beside the upload and the old one removed before the swap,
+    # so the new CSV is never read through the previous file's snapshot.
+    snapshot = snapshot_path(file_path)
+    staged = None
+    try:
+        df = read_upload(upload_path)
+        staged = write_snapshot(upload_path, df)
+        _discard(snapshot)
+        os.replace(upload_path, file_path)
+    except BaseException:
+        if staged is not None:
+            _discard(staged)
+        raise
+    finally:
+        _discard(upload_path)
+    invalidate(file_path)
+    # The upload is live from here on; without its snapshot the CSV is just parsed again
+    if staged is not None:
+        try:
+            os.replace(staged, snapshot)
+        except OSError:
+            _discard(staged)
+    return len(df)
+
+def ingest_store(upload_path, store, user_id):
+    try:
+        df = read_upload(upload_path)
+        store.import_frame(user_id, df, replace=True)
+        return len(df)
+    finally:
+        _discard(upload_path)
+
+def _prune(now):
+    for job_id, job in list(_jobs.items()):
+        if job['future'].done() and now - job['submitted'] > INGEST_RETENTION_SECONDS:
+            del _jobs[job_id]
+
+def submit_ingest(fn, upload_path, *args):
+    job_id = uuid.uuid4().hex
+    future = _executor.submit(fn, upload_path, *args)
+    now = time.time()
+    with _jobs_lock:
+        _prune(now)
+        _jobs[job_id] = {'future': future, 'submitted': now}
+    return job_id
+
+def ingest_status(job_id):
+    if not JOB_ID_PATTERN.fullmatch(job_id):
+        return None
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        return None
+    future = job['future']
+    if not future.done():
+        return {'status': 'running' if future.running() else 'queued'}
+    error = future.exception()
+    if error is not None:
+        return {'status': 'failed', 'error': str(error) or type(error).__name__}
+    return {'status': 'done', 'rows': future.result()}
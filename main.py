@@ -1,8 +1,19 @@
 import requests
+import argparse
+import codecs
 import csv
+import heapq
+import io
+import json
 import os
+import stat
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dataset import append_snapshot, snapshot_is_fresh, write_snapshot
 
 load_dotenv() 
 
@@ -10,15 +21,23 @@ load_dotenv()
 SLACK_API_TOKEN = os.getenv("api_token")
 SLACK_USER_ID = os.getenv("user_id")
 CSV_FILE_PATH = 'arcade_sessions.csv'
-
-print(SLACK_API_TOKEN)
+CSV_COLUMNS = ['Created At', 'Time', 'Elapsed', 'Goal', 'Ended', 'Work']
+API_URL = 'https://hackhour.hackclub.com/api/history/{user_id}'
+OUTPUT_DIR = 'sessions'
+MAX_CONNECTIONS_PER_HOST = 8
+STREAM_CHUNK_SIZE = 64 * 1024
+SORT_RUN_SIZE = 100_000
+MAX_RETRIES = 5
+RETRY_BACKOFF = 0.5
+# Mode of a newly written CSV; temp files are created 0600
+OUTPUT_FILE_MODE = 0o644
 
 headers = {
     'Authorization': f'Bearer {SLACK_API_TOKEN}'
 }
 
 def fetch_sessions():
-    url = f'https://hackhour.hackclub.com/api/history/{SLACK_USER_ID}'
+    url = API_URL.format(user_id=SLACK_USER_ID)
     response = requests.get(url, headers=headers)
     if response.status_code == 200:
         return response.json().get('data', [])
@@ -26,27 +45,385 @@ def fetch_sessions():
         print(f"Failed to fetch sessions: {response.status_code}")
         return []
 
-def write_to_csv(sessions):
+def create_http_session(max_connections=MAX_CONNECTIONS_PER_HOST):
+    # One keep-alive pool per host; pool_block caps the number of concurrent
+    # connections to the API no matter how many workers are running
+    retry = Retry(total=MAX_RETRIES, backoff_factor=RETRY_BACKOFF,
+                  status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset(['GET']))
+    adapter = HTTPAdapter(pool_maxsize=max_connections, pool_block=True, max_retries=retry)
+    http = requests.Session()
+    http.headers.update(headers)
+    http.mount('https://', adapter)
+    http.mount('http://', adapter)
+    return http
+
+def fetch_user_history(http, user_id):
+    response = http.get(API_URL.format(user_id=user_id))
+    response.raise_for_status()
+    return response.json().get('data', [])
+
+class JsonStream:
+    # Minimal pull parser over an iterable of byte chunks; values are decoded
+    # one at a time so only the current element has to fit in memory
+    _decoder = json.JSONDecoder()
+    _delimiters = frozenset(',]} \t\r\n')
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._done = False
+
+    def _fill(self):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._done = True
+            return False
+        self._buffer = self._buffer[self._pos:] + self._text.decode(chunk)
+        self._pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of JSON stream')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self._pos} of JSON stream")
+        self._pos += 1
+
+    def skip(self, char):
+        if self.peek() == char:
+            self._pos += 1
+            return True
+        return False
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A bare number is only complete once a delimiter follows it; "1." or "1.5e"
+            # at the end of the buffer may continue in the next chunk
+            if (not isinstance(value, (dict, list, str)) and self._buffer[end:end + 1] not in self._delimiters
+                    and self._fill()):
+                continue
+            self._pos = end
+            return value
+
+def iter_sessions(chunks):
+    stream = JsonStream(chunks)
+    stream.expect('{')
+    if stream.skip('}'):
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key == 'data':
+            stream.expect('[')
+            if not stream.skip(']'):
+                while True:
+                    yield stream.value()
+                    if not stream.skip(','):
+                        stream.expect(']')
+                        break
+        else:
+            stream.value()
+        if not stream.skip(','):
+            stream.expect('}')
+            return
+
+def stream_user_history(http, user_id):
+    with http.get(API_URL.format(user_id=user_id), stream=True) as response:
+        response.raise_for_status()
+        yield from iter_sessions(response.iter_content(chunk_size=STREAM_CHUNK_SIZE))
+
+def parse_created_at(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def session_row(session):
+    return [
+        session.get('createdAt', ''),
+        session.get('time', ''),
+        session.get('elapsed', ''),
+        session.get('goal', ''),
+        session.get('ended', ''),
+        session.get('work', '')
+    ]
+
+def write_to_csv(sessions, file_path=CSV_FILE_PATH):
     # Sort sessions by createdAt in ascending order
-    sessions.sort(key=lambda x: datetime.fromisoformat(x['createdAt'].replace('Z', '+00:00')))
+    sessions.sort(key=lambda x: parse_created_at(x['createdAt']))
     
-    with open(CSV_FILE_PATH, mode='w', newline='') as file:
+    with open(file_path, mode='w', newline='') as file:
         writer = csv.writer(file)
-        writer.writerow(['Created At', 'Time', 'Elapsed', 'Goal', 'Ended', 'Work'])
+        writer.writerow(CSV_COLUMNS)
+        for session in sessions:
+            writer.writerow(session_row(session))
+    if sessions:
+        write_watermark(sessions[-1]['createdAt'], file_path)
+
+def _spill_run(rows, runs, last_key, directory):
+    rows.sort(key=lambda row: row[0])
+    # Batches that continue the previous run extend it, so input that already
+    # arrives in order ends up as a single run and needs no merge
+    if runs and rows[0][0] >= last_key:
+        run = runs[-1]
+    else:
+        run = tempfile.NamedTemporaryFile(mode='w', newline='', dir=directory, suffix='.run', delete=False)
+        if not runs:
+            csv.writer(run).writerow(CSV_COLUMNS)
+        runs.append(run)
+    csv.writer(run).writerows(row[1] for row in rows)
+    return rows[-1][0]
+
+def _read_run(path, skip_header):
+    with open(path, newline='') as file:
+        reader = csv.reader(file)
+        if skip_header:
+            next(reader, None)
+        for row in reader:
+            yield parse_created_at(row[0]), row
+
+def _output_mode(file_path):
+    # The output keeps the mode of the file it replaces
+    try:
+        return stat.S_IMODE(os.stat(file_path).st_mode)
+    except FileNotFoundError:
+        return OUTPUT_FILE_MODE
+
+def write_sessions_streaming(sessions, file_path=CSV_FILE_PATH, run_size=SORT_RUN_SIZE):
+    # External merge sort: at most run_size rows are held in memory at once
+    directory = os.path.dirname(os.path.abspath(file_path))
+    runs = []
+    rows = []
+    last_key = None
+    last_created_at = None
+    count = 0
+    try:
         for session in sessions:
-            writer.writerow([
-                session.get('createdAt', ''),
-                session.get('time', ''),
-                session.get('elapsed', ''),
-                session.get('goal', ''),
-                session.get('ended', ''),
-                session.get('work', '')
-            ])
+            rows.append((parse_created_at(session['createdAt']), session_row(session)))
+            if len(rows) >= run_size:
+                last_key = _spill_run(rows, runs, last_key, directory)
+                rows = []
+            count += 1
+        if rows:
+            last_key = _spill_run(rows, runs, last_key, directory)
+            rows = []
+        for run in runs:
+            run.close()
+
+        if len(runs) <= 1:
+            if not runs:
+                with open(file_path, mode='w', newline='') as file:
+                    csv.writer(file).writerow(CSV_COLUMNS)
+                return 0
+            run = runs.pop()
+            os.chmod(run.name, _output_mode(file_path))
+            os.replace(run.name, file_path)
+            last_created_at = last_key
+        else:
+            with tempfile.NamedTemporaryFile(mode='w', newline='', dir=directory, suffix='.tmp',
+                                             delete=False) as output:
+                writer = csv.writer(output)
+                writer.writerow(CSV_COLUMNS)
+                merged = heapq.merge(*(_read_run(run.name, n == 0) for n, run in enumerate(runs)),
+                                     key=lambda item: item[0])
+                for last_created_at, row in merged:
+                    writer.writerow(row)
+            os.chmod(output.name, _output_mode(file_path))
+            os.replace(output.name, file_path)
+    finally:
+        for run in runs:
+            run.close()
+            os.remove(run.name)
+    if last_created_at is not None:
+        write_watermark(last_created_at.isoformat(timespec='milliseconds').replace('+00:00', 'Z'), file_path)
+    return count
+
+def watermark_path(file_path=CSV_FILE_PATH):
+    return os.path.splitext(file_path)[0] + '.watermark'
+
+def write_watermark(created_at, file_path=CSV_FILE_PATH):
+    path = watermark_path(file_path)
+    with open(path + '.tmp', mode='w') as file:
+        file.write(created_at)
+    os.replace(path + '.tmp', path)
+
+def last_created_at(file_path=CSV_FILE_PATH):
+    # The CSV is kept in createdAt order, so its last row is the newest session
+    with open(file_path, mode='rb') as file:
+        file.seek(0, os.SEEK_END)
+        file.seek(max(0, file.tell() - 65536))
+        lines = file.read().decode('ISO-8859-1').splitlines()
+    for line in reversed(lines):
+        fields = next(csv.reader([line]), [])
+        if not fields or not fields[0]:
+            continue
+        if fields[0] == CSV_COLUMNS[0]:
+            return None
+        try:
+            return parse_created_at(fields[0])
+        except ValueError:
+            # Tail of a multi-line quoted field; the record starts further up
+            continue
+    return None
+
+def read_watermark(file_path=CSV_FILE_PATH):
+    watermark = None
+    try:
+        with open(watermark_path(file_path)) as file:
+            value = file.read().strip()
+        if value:
+            watermark = parse_created_at(value)
+    except FileNotFoundError:
+        pass
+    # An append that landed without its watermark update must not be re-applied
+    last = last_created_at(file_path)
+    if last is not None and (watermark is None or last > watermark):
+        watermark = last
+    return watermark
+
+def append_new_sessions(sessions, file_path=CSV_FILE_PATH):
+    if not os.path.exists(file_path):
+        sessions = list(sessions)
+        write_to_csv(sessions, file_path)
+        return sessions
+
+    watermark = read_watermark(file_path)
+    new_sessions = {}
+    for session in sessions:
+        if watermark is None or parse_created_at(session['createdAt']) > watermark:
+            new_sessions[session['createdAt']] = session
+    new_sessions = sorted(new_sessions.values(), key=lambda x: parse_created_at(x['createdAt']))
+    if not new_sessions:
+        return []
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for session in new_sessions:
+        writer.writerow(session_row(session))
+
+    # Append all new rows in one write and roll back to the previous size on failure,
+    # so readers never see a partially appended batch
+    with open(file_path, mode='a', newline='') as file:
+        size = file.tell()
+        try:
+            file.write(buffer.getvalue())
+            file.flush()
+            os.fsync(file.fileno())
+        except BaseException:
+            file.truncate(size)
+            raise
+    write_watermark(new_sessions[-1]['createdAt'], file_path)
+    return new_sessions
+
+def sync_incremental(sessions, file_path=CSV_FILE_PATH):
+    snapshot_fresh = os.path.exists(file_path) and snapshot_is_fresh(file_path)
+    new_sessions = append_new_sessions(sessions, file_path)
+    if new_sessions:
+        if snapshot_fresh:
+            append_snapshot(file_path, [session_row(session) for session in new_sessions])
+        else:
+            write_snapshot(file_path)
+    return new_sessions
+
+def sync_user(http, user_id, output_dir=OUTPUT_DIR, incremental=False, stream=False):
+    file_path = os.path.join(output_dir, f'{user_id}.csv')
+    if stream:
+        sessions = stream_user_history(http, user_id)
+        if incremental:
+            return len(sync_incremental(sessions, file_path))
+        count = write_sessions_streaming(sessions, file_path)
+        write_snapshot(file_path)
+        return count
+    sessions = fetch_user_history(http, user_id)
+    if incremental:
+        return len(sync_incremental(sessions, file_path))
+    write_to_csv(sessions, file_path)
+    write_snapshot(file_path)
+    return len(sessions)
+
+def sync_users(user_ids, output_dir=OUTPUT_DIR, max_workers=MAX_CONNECTIONS_PER_HOST, incremental=False,
+               stream=False):
+    os.makedirs(output_dir, exist_ok=True)
+    results = {}
+    with create_http_session(max_workers) as http, ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(sync_user, http, user_id, output_dir, incremental, stream): user_id
+            for user_id in dict.fromkeys(user_ids)
+        }
+        for future in as_completed(futures):
+            user_id = futures[future]
+            try:
+                results[user_id] = future.result()
+            except (requests.RequestException, ValueError, OSError) as e:
+                print(f"Failed to fetch sessions for {user_id}: {e}")
+                results[user_id] = None
+    return results
+
+def read_user_ids(file_path):
+    with open(file_path) as file:
+        return [line.strip() for line in file if line.strip() and not line.startswith('#')]
 
 def main():
+    parser = argparse.ArgumentParser(description='Fetch arcade sessions into a CSV file')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only append sessions newer than the last sync instead of rewriting the file')
+    parser.add_argument('--users', nargs='+', default=[],
+                        help='fetch these user IDs concurrently, writing one CSV per user')
+    parser.add_argument('--users-file', help='file with one user ID per line, for batch fetching')
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help='directory for per-user CSV files')
+    parser.add_argument('--workers', type=int, default=MAX_CONNECTIONS_PER_HOST,
+                        help='maximum concurrent requests to the API')
+    parser.add_argument('--stream', action='store_true',
+                        help='parse the history as it downloads and write rows without holding it all in memory')
+    args = parser.parse_args()
+
+    user_ids = args.users + (read_user_ids(args.users_file) if args.users_file else [])
+    if user_ids:
+        results = sync_users(user_ids, args.output_dir, args.workers, args.incremental, args.stream)
+        failed = [user_id for user_id, count in results.items() if count is None]
+        print(f"Synced {len(results) - len(failed)} of {len(results)} users into {args.output_dir}")
+        if failed:
+            print(f"Failed users: {', '.join(failed)}")
+        return
+
+    if args.stream:
+        with create_http_session() as http:
+            sessions = stream_user_history(http, SLACK_USER_ID)
+            if args.incremental:
+                new_sessions = sync_incremental(sessions)
+                print(f"{len(new_sessions)} new sessions have been appended to {CSV_FILE_PATH}")
+            else:
+                count = write_sessions_streaming(sessions)
+                print(f"{count} sessions have been written to {CSV_FILE_PATH}")
+                snapshot = write_snapshot(CSV_FILE_PATH)
+                if snapshot:
+                    print(f"Typed snapshot has been written to {snapshot}")
+        return
+
     sessions = fetch_sessions()
+    if args.incremental:
+        new_sessions = sync_incremental(sessions)
+        print(f"{len(new_sessions)} new sessions have been appended to {CSV_FILE_PATH}")
+        return
+
     write_to_csv(sessions)
     print(f"Session data has been written to {CSV_FILE_PATH}")
+    snapshot = write_snapshot(CSV_FILE_PATH)
+    if snapshot:
+        print(f"Typed snapshot has been written to {snapshot}")
 
 if __name__ == '__main__':
     main()
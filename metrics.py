@@ -0,0 +1,237 @@
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+# In-process instrumentation: per-stage and per-route latency histograms exposed in
+# the Prometheus text format, plus an opt-in sampling profiler for slow requests.
+# Each process keeps its own numbers, so scrape every worker process separately.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_THRESHOLD_SECONDS = 1.0
+PROFILE_FOLDER = 'profiles'
+PROFILE_MAX_DEPTH = 64
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+_collectors = []
+_local = threading.local()
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, list(counts), total, count)
+                            for labels, (counts, total, count) in self._series.items())
+        for labels, counts, total, count in series:
+            label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            prefix = label_text + ',' if label_text else ''
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {count}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def histogram(name, help_text, label_names):
+    with _histograms_lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram(name, help_text, label_names)
+        return _histograms[name]
+
+STAGE_SECONDS = histogram('arcade_stage_duration_seconds', 'Time spent in each instrumented stage.', ('stage',))
+REQUEST_SECONDS = histogram('arcade_request_duration_seconds', 'Request latency by route.',
+                            ('route', 'method', 'status'))
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, name)
+        stages = getattr(_local, 'stages', None)
+        if stages is not None:
+            stages[name] += elapsed
+
+def timed(name):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def add_collector(collect):
+    # collect() returns (name, type, help, value) tuples, read on every scrape
+    _collectors.append(collect)
+
+def render_metrics():
+    lines = []
+    with _histograms_lock:
+        histograms = list(_histograms.values())
+    for hist in histograms:
+        lines.extend(hist.render())
+    for collect in _collectors:
+        for name, metric_type, help_text, value in collect():
+            lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}', f'{name} {value}'])
+    return '\n'.join(lines) + '\n'
+
+
+class Sampler:
+    # Wall-clock stack sampler: one background thread periodically snapshots the
+    # stacks of threads that are serving profiled requests. Cheap enough to leave on
+    # under load, unlike a tracing profiler, and only slow requests are written out.
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, thread_id):
+        with self._lock:
+            self._active[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+                self._thread.start()
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._active.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, stacks in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[_collapse(frame)] += 1
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+def write_profile(stacks, route, elapsed, folder=PROFILE_FOLDER):
+    # Folded-stack format ("outer;inner count"), readable by flamegraph.pl and speedscope
+    os.makedirs(folder, exist_ok=True)
+    route_name = route.strip('/').replace('/', '_').replace('<', '').replace('>', '') or 'index'
+    path = os.path.join(folder, f'{time.strftime("%Y%m%d-%H%M%S")}-{route_name}-{int(elapsed * 1000)}ms.folded')
+    with open(path, 'w') as file:
+        for stack, count in stacks.most_common():
+            file.write(f'{stack} {count}\n')
+    return path
+
+sampler = Sampler()
+
+
+def init_app(app, is_admin=None):
+    # Config: PROFILE_SLOW_REQUESTS (off by default), PROFILE_THRESHOLD_SECONDS, PROFILE_FOLDER,
+    # METRICS_TOKEN (bearer token that lets a scraper read /metrics without an admin session)
+    from flask import abort, g, request
+
+    app.config.setdefault('PROFILE_SLOW_REQUESTS', False)
+    app.config.setdefault('PROFILE_THRESHOLD_SECONDS', PROFILE_THRESHOLD_SECONDS)
+    app.config.setdefault('PROFILE_FOLDER', PROFILE_FOLDER)
+    app.config.setdefault('METRICS_TOKEN', None)
+
+    def finish_request(started, route, method, path, status, profiled):
+        elapsed = time.perf_counter() - started
+        REQUEST_SECONDS.observe(elapsed, route, method, status)
+        if profiled:
+            stacks = sampler.stop(threading.get_ident())
+            if elapsed >= app.config['PROFILE_THRESHOLD_SECONDS'] and stacks:
+                profile = write_profile(stacks, route, elapsed, app.config['PROFILE_FOLDER'])
+                app.logger.warning('Slow request %s %s took %.3f s; profile written to %s',
+                                   method, path, elapsed, profile)
+
+    def pop_request(status):
+        started = g.pop('request_started', None)
+        if started is None:
+            return None
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        return started, route, request.method, request.path, status, g.pop('profiled', False)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+        _local.stages = Counter()
+        if app.config['PROFILE_SLOW_REQUESTS']:
+            g.profiled = True
+            sampler.start(threading.get_ident())
+
+    @app.after_request
+    def record_status(response):
+        g.response_status = response.status_code
+        # Per-stage breakdown of this request, shown by browser dev tools
+        stages = getattr(_local, 'stages', None)
+        if stages:
+            response.headers['Server-Timing'] = ', '.join(
+                f'{name};dur={seconds * 1000:.1f}' for name, seconds in stages.items())
+        if response.is_streamed:
+            # A streamed body is generated after teardown, so time the request until the
+            # server closes the response instead
+            finished = pop_request(response.status_code)
+            if finished is not None:
+                response.call_on_close(lambda: finish_request(*finished))
+        return response
+
+    @app.teardown_request
+    def record_request(error=None):
+        finished = pop_request(g.pop('response_status', 500))
+        _local.stages = None
+        if finished is not None:
+            finish_request(*finished)
+
+    @app.route('/metrics')
+    def metrics():
+        # Admin sessions, or a scraper sending "Authorization: Bearer <METRICS_TOKEN>"
+        token = app.config['METRICS_TOKEN']
+        authorization = request.headers.get('Authorization', '')
+        if not ((is_admin is not None and is_admin())
+                or (token and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()))):
+            abort(403)
+        return app.response_class(render_metrics(), mimetype='text/plain; version=0.0.4')
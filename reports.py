@@ -0,0 +1,191 @@
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import plotly.graph_objects as go
+import plotly.io as pio
+from fpdf import FPDF
+
+from analytics import to_plotly
+
+REPORT_FOLDER = 'reports'
+REPORT_WORKERS = min(4, os.cpu_count() or 1)
+PNG_CACHE_FOLDER = os.path.join(REPORT_FOLDER, 'png')
+PNG_CACHE_BYTES = 256 * 1024 * 1024
+PNG_WIDTH = 700
+PNG_HEIGHT = 500
+REPORT_RETENTION_SECONDS = 60 * 60
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_executor = None
+# Threads that wait on a job's rasterization and assembly steps in the process pool
+_coordinator = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix='report')
+
+
+def create_pdf_report(images, summary_stats):
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+
+    # Add summary stats
+    pdf.cell(200, 10, txt="Arcade Sessions Report", ln=True, align='C')
+    pdf.ln(10)
+    pdf.cell(200, 10, txt=f"Total Sessions: {summary_stats['total_sessions']}", ln=True)
+    pdf.cell(200, 10, txt=f"Average Session Time: {summary_stats['average_session_time']:.2f} minutes", ln=True)
+    pdf.cell(200, 10, txt=f"Median Session Time: {summary_stats['median_session_time']:.2f} minutes", ln=True)
+    pdf.cell(200, 10, txt=f"Total Elapsed Time: {summary_stats['total_elapsed_time']} minutes", ln=True)
+
+    pdf.ln(10)
+    pdf.cell(200, 10, txt="Sessions per Goal:", ln=True)
+    for goal, count in summary_stats['sessions_per_goal'].items():
+        pdf.cell(200, 10, txt=f"{goal}: {count}", ln=True)
+
+    # Add plots, already rasterized to PNG files
+    for image in images:
+        pdf.image(image, x=10, y=None, w=180)
+
+    return pdf
+
+def _start_image_export():
+    # Runs once in each worker. Kaleido 1.x starts a headless browser per export
+    # unless a sync server is running; older versions keep their subprocess alive
+    # after the first export. Either way, pay the start-up here rather than per report.
+    try:
+        import kaleido
+        pio.to_image(go.Figure(), format='png')
+    except Exception:
+        # No usable image export (e.g. no browser for Kaleido); each job reports the error
+        return
+    # Only once an export has worked: a sync server that fails to start leaves callers waiting
+    if hasattr(kaleido, 'start_sync_server'):
+        kaleido.start_sync_server(silence_warnings=True)
+
+def png_cache_path(fig):
+    # Keyed by the full figure JSON, so any change to data, layout or template re-renders
+    spec = fig.to_json()
+    key = hashlib.sha256(f'{PNG_WIDTH}x{PNG_HEIGHT}:{spec}'.encode()).hexdigest()
+    return os.path.join(PNG_CACHE_FOLDER, key[:2], f'{key}.png')
+
+def rasterize(chart):
+    # Runs in a report worker; returns the cached PNG for the chart, rendering it on a miss
+    fig = to_plotly(chart)
+    path = png_cache_path(fig)
+    if os.path.exists(path):
+        # Touched on every hit so pruning drops the least recently used images first
+        os.utime(path)
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    image = pio.to_image(fig, format='png', width=PNG_WIDTH, height=PNG_HEIGHT)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(image)
+    os.replace(tmp_path, path)
+    return path
+
+def build_report(images, summary_stats, path):
+    pdf = create_pdf_report(images, summary_stats)
+    tmp_path = path + '.tmp'
+    pdf.output(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+def prune_png_cache(max_bytes=PNG_CACHE_BYTES):
+    entries = []
+    for directory, _, files in os.walk(PNG_CACHE_FOLDER):
+        for name in files:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def _get_executor():
+    global _executor
+    with _jobs_lock:
+        if _executor is None:
+            # spawn: forking a threaded web server can copy held locks into the worker
+            _executor = ProcessPoolExecutor(max_workers=REPORT_WORKERS, initializer=_start_image_export,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+def _reset_executor():
+    global _executor
+    with _jobs_lock:
+        broken, _executor = _executor, None
+    if broken is not None:
+        broken.shutdown(wait=False, cancel_futures=True)
+
+def report_path(job_id):
+    return os.path.join(REPORT_FOLDER, f'{job_id}.pdf')
+
+def _prune(now):
+    for job_id, job in list(_jobs.items()):
+        if job['future'].done() and now - job['submitted'] > REPORT_RETENTION_SECONDS:
+            del _jobs[job_id]
+            try:
+                os.remove(report_path(job_id))
+            except FileNotFoundError:
+                pass
+
+def _submit(fn, *args):
+    try:
+        return _get_executor().submit(fn, *args)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool once
+        _reset_executor()
+        return _get_executor().submit(fn, *args)
+
+def _run_report(charts, summary_stats, path):
+    # Every chart is rasterized in parallel across the pool, then the PDF is
+    # assembled from the PNGs; unchanged charts come straight from the PNG cache
+    rasters = [_submit(rasterize, chart) for chart in charts]
+    images = [raster.result() for raster in rasters]
+    _submit(build_report, images, summary_stats, path).result()
+    prune_png_cache()
+    return path
+
+def submit_report(charts, summary_stats):
+    # charts are analytics.Chart objects, already reduced, so they pickle cheaply to the workers
+    os.makedirs(REPORT_FOLDER, exist_ok=True)
+    job_id = uuid.uuid4().hex
+    future = _coordinator.submit(_run_report, charts, summary_stats, report_path(job_id))
+    now = time.time()
+    with _jobs_lock:
+        _prune(now)
+        _jobs[job_id] = {'future': future, 'submitted': now}
+    return job_id
+
+def report_status(job_id):
+    # Jobs are tracked per web process; a finished file on disk is enough to
+    # answer for jobs submitted through another process
+    if not JOB_ID_PATTERN.fullmatch(job_id):
+        return None
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        return {'status': 'done'} if os.path.exists(report_path(job_id)) else None
+    future = job['future']
+    if not future.done():
+        return {'status': 'running' if future.running() else 'queued'}
+    error = future.exception()
+    if error is not None:
+        return {'status': 'failed', 'error': str(error) or type(error).__name__}
+    return {'status': 'done'}
@@ -0,0 +1,371 @@
+import argparse
+import os
+import re
+import sqlite3
+import threading
+from functools import cached_property, lru_cache
+
+import pandas as pd
+
+from analytics import Selection
+from dataset import ROLLUP_COLUMNS, preprocess_data, read_csv, with_daily_means
+from datatable import NUMERIC_COLUMNS, TABLE_COLUMNS, parse_range
+from metrics import stage, timed
+
+# Sessions of many users in one embedded SQLite database. Every query is scoped to
+# one user through the (user, created_at) and (user, goal) indexes, so its cost
+# follows that user's history rather than the size of the whole store.
+
+STORE_PATH = 'arcade_sessions.db'
+DAY_MS = 86_400_000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    user_id TEXT NOT NULL,
+    created_at INTEGER,
+    time INTEGER NOT NULL,
+    elapsed INTEGER NOT NULL,
+    goal TEXT,
+    ended INTEGER,
+    work TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS sessions_user_created_at ON sessions (user_id, created_at);
+CREATE INDEX IF NOT EXISTS sessions_user_goal ON sessions (user_id, goal);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+'''
+
+# Column name in the app -> SQL expression
+COLUMNS = {
+    'Created At': 'created_at',
+    'Time': 'time',
+    'Elapsed': 'elapsed',
+    'Goal': 'goal',
+    'Ended': 'ended',
+    'Work': 'work',
+}
+# Matches the text Dataset.search_text is built from: columns joined by \x1f, lowercased
+COLUMN_TEXT = {
+    'Created At': "coalesce(strftime('%Y-%m-%d %H:%M:%f', created_at / 1000.0, 'unixepoch') || '000+00:00', '')",
+    'Time': 'time',
+    'Elapsed': 'elapsed',
+    'Goal': "coalesce(goal, '')",
+    'Ended': "CASE ended WHEN 1 THEN 'true' ELSE 'false' END",
+    'Work': "coalesce(work, '')",
+}
+SEARCH_TEXT = 'lower(%s)' % " || char(31) || ".join(COLUMN_TEXT[column] for column in TABLE_COLUMNS)
+SELECT_COLUMNS = 'created_at, time, elapsed, goal, ended, work'
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+@lru_cache(maxsize=256)
+def _word_pattern(word):
+    return re.compile(r'(?<!\w)%s(?!\w)' % re.escape(word))
+
+def _has_word(text, word):
+    # Same whole-word rule as dataset.build_word_index (words are runs of \w)
+    return text is not None and _word_pattern(word).search(text.lower()) is not None
+
+def _epoch_ms(value):
+    # Naive dates and times are UTC, as in analytics._date_bound
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize('UTC')
+    return int(timestamp.value // 1_000_000)
+
+def _values(series):
+    return series.astype(object).where(series.notna(), None).tolist()
+
+def _created_at_ms(series):
+    if series.dt.tz is not None:
+        series = series.dt.tz_convert(None)
+    ms = pd.Series(series.to_numpy(dtype='datetime64[ms]').astype('int64'), index=series.index)
+    return _values(ms.where(series.notna()).astype('Int64'))
+
+def _frame(raw):
+    # Rows as the app's DataFrame, typed like preprocess_data's output
+    return pd.DataFrame({
+        'Created At': pd.to_datetime(raw['created_at'], unit='ms', utc=True),
+        'Time': raw['time'].astype('int64'),
+        'Elapsed': raw['elapsed'].astype('int64'),
+        'Goal': raw['goal'].astype('category'),
+        'Ended': raw['ended'].eq(1),
+        'Work': raw['work'],
+    })
+
+
+class SessionStore:
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        # One connection per thread; WAL lets readers run while an import writes
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            connection.create_function('has_word', 2, _has_word, deterministic=True)
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def version(self, user_id):
+        # Bumped on every write to the user's rows; keys the selection and figure caches
+        row = self.connection.execute('SELECT version FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def users(self):
+        return [row[0] for row in self.connection.execute('SELECT user_id FROM users ORDER BY user_id')]
+
+    @timed('store_import')
+    def import_frame(self, user_id, df, replace=False):
+        # df is typed by preprocess_data; sessions already stored (same Created At) are skipped
+        # unless replace drops the user's previous rows first. Rows without a Created At can't
+        # be matched, so those of the latest import replace the stored ones. Returns the number
+        # of rows written.
+        rows = zip(
+            [user_id] * len(df),
+            _created_at_ms(df['Created At']),
+            df['Time'].tolist(),
+            df['Elapsed'].tolist(),
+            _values(df['Goal']),
+            _values(df['Ended'].astype('boolean').astype('Int64')),
+            _values(df['Work']),
+        )
+        with self.connection as connection:
+            if replace:
+                connection.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
+            else:
+                connection.execute('DELETE FROM sessions WHERE user_id = ? AND created_at IS NULL', (user_id,))
+            cursor = connection.executemany('INSERT OR IGNORE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            connection.execute('INSERT INTO users (user_id, version) VALUES (?, 1) '
+                               'ON CONFLICT (user_id) DO UPDATE SET version = version + 1', (user_id,))
+        return cursor.rowcount
+
+    def import_csv(self, user_id, file_path, replace=False):
+        return self.import_frame(user_id, preprocess_data(read_csv(file_path)), replace)
+
+    def where(self, user_id, start_date=None, end_date=None, goals=(), search_query=None, search_mode=None,
+              min_time=None, max_time=None, exclude_60=False):
+        clauses = ['user_id = ?']
+        params = [user_id]
+        if start_date:
+            clauses.append('created_at >= ?')
+            params.append(_epoch_ms(start_date))
+        if end_date:
+            clauses.append('created_at <= ?')
+            params.append(_epoch_ms(end_date))
+        if goals:
+            goals = list(dict.fromkeys(goals))
+            clauses.append('goal IN (%s)' % ', '.join('?' * len(goals)))
+            params.extend(goals)
+        if min_time is not None:
+            clauses.append('time >= ?')
+            params.append(min_time)
+        if max_time is not None:
+            clauses.append('time <= ?')
+            params.append(max_time)
+        if exclude_60:
+            clauses.append('time != 60')
+        if search_query:
+            if search_mode == 'words':
+                for word in re.findall(r'\w+', search_query.lower()):
+                    clauses.append('(has_word(goal, ?) OR has_word(work, ?))')
+                    params.extend([word, word])
+            else:
+                clauses.append('instr(%s, ?) > 0' % SEARCH_TEXT)
+                params.append(search_query.lower())
+        return ' AND '.join(clauses), params
+
+    def count(self, user_id, **filters):
+        where, params = self.where(user_id, **filters)
+        return self.connection.execute('SELECT count(*) FROM sessions WHERE ' + where, params).fetchone()[0]
+
+    def goals(self, user_id):
+        return [row[0] for row in self.connection.execute(
+            'SELECT DISTINCT goal FROM sessions WHERE user_id = ? AND goal IS NOT NULL ORDER BY goal', (user_id,))]
+
+    def sessions(self, user_id, order_by='created_at IS NULL, created_at', limit=None, offset=0, **filters):
+        where, params = self.where(user_id, **filters)
+        sql = 'SELECT %s FROM sessions WHERE %s ORDER BY %s' % (SELECT_COLUMNS, where, order_by)
+        if limit is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            params += [limit, offset]
+        return _frame(pd.read_sql_query(sql, self.connection, params=params))
+
+    def summary_stats(self, user_id, **filters):
+        # Same result as analytics.summary_stats on the selected rows
+        where, params = self.where(user_id, **filters)
+        connection = self.connection
+        total, average, elapsed = connection.execute(
+            'SELECT count(*), avg(time), coalesce(sum(elapsed), 0) FROM sessions WHERE ' + where, params).fetchone()
+        median = float('nan')
+        if total:
+            middle = connection.execute(
+                'SELECT time FROM sessions WHERE %s ORDER BY time LIMIT ? OFFSET ?' % where,
+                params + [2 - total % 2, (total - 1) // 2]).fetchall()
+            median = sum(row[0] for row in middle) / len(middle)
+        per_goal = connection.execute(
+            'SELECT goal, count(*) AS sessions FROM sessions WHERE %s AND goal IS NOT NULL '
+            'GROUP BY goal ORDER BY sessions DESC' % where, params).fetchall()
+        return {
+            'total_sessions': total,
+            'average_session_time': float('nan') if average is None else float(average),
+            'median_session_time': float(median),
+            'total_elapsed_time': int(elapsed),
+            'sessions_per_goal': {goal: count for goal, count in per_goal},
+        }
+
+    def daily_totals(self, user_id, **filters):
+        # Per-day rollup like Dataset.daily_totals, aggregated by SQLite
+        where, params = self.where(user_id, **filters)
+        daily = pd.read_sql_query(
+            'SELECT created_at / %d AS day, count(*) AS sessions, sum(time) AS time, sum(elapsed) AS elapsed, '
+            'sum(time != 60) AS sessions_excl_60, '
+            'sum(CASE WHEN time != 60 THEN time ELSE 0 END) AS time_excl_60, '
+            'sum(CASE WHEN time != 60 THEN elapsed ELSE 0 END) AS elapsed_excl_60 '
+            'FROM sessions WHERE %s AND created_at IS NOT NULL GROUP BY day ORDER BY day' % (DAY_MS, where),
+            self.connection, params=params)
+        daily.index = pd.DatetimeIndex(pd.to_datetime(daily.pop('day') * DAY_MS, unit='ms', utc=True), name='Day')
+        return with_daily_means(daily[ROLLUP_COLUMNS].astype('int64'))
+
+    def table_response(self, user_id, params, **filters):
+        # The DataTables envelope of datatable.table_response, paged by SQL
+        where, where_params = self.where(user_id, search_query=params['search'] or None, **filters)
+        for column in params['columns']:
+            name, value = column['data'], column['search'].strip()
+            if not value or name not in COLUMNS:
+                continue
+            if name in NUMERIC_COLUMNS:
+                bounds = parse_range(value)
+                if bounds is None:
+                    where += ' AND 0'
+                    continue
+                for bound, operator in zip(bounds, ('>=', '<=')):
+                    if bound is not None:
+                        where += ' AND %s %s ?' % (COLUMNS[name], operator)
+                        where_params.append(bound)
+            else:
+                where += ' AND instr(lower(%s), ?) > 0' % COLUMN_TEXT[name]
+                where_params.append(value.lower())
+
+        connection = self.connection
+        total = connection.execute('SELECT count(*) FROM sessions WHERE user_id = ?', (user_id,)).fetchone()[0]
+        filtered = connection.execute('SELECT count(*) FROM sessions WHERE ' + where, where_params).fetchone()[0]
+        order_by = 'created_at IS NULL, created_at'
+        for index, descending in params['order']:
+            if 0 <= index < len(params['columns']):
+                column = params['columns'][index]
+                if column['orderable'] and column['data'] in COLUMNS:
+                    # Missing values sort last either way, as Dataset.sort_order puts them
+                    expression = COLUMNS[column['data']]
+                    order_by = '%s IS NULL%s, %s%s, rowid%s' % (
+                        expression, ' DESC' if descending else '', expression,
+                        ' DESC' if descending else '', ' DESC' if descending else '')
+                    break
+        raw = pd.read_sql_query(
+            'SELECT %s FROM sessions WHERE %s ORDER BY %s LIMIT ? OFFSET ?' % (SELECT_COLUMNS, where, order_by),
+            connection, params=where_params + [params['length'], params['start']])
+        page = _frame(raw)
+        return '{"draw":%d,"recordsTotal":%d,"recordsFiltered":%d,"data":%s}' % (
+            params['draw'], total, filtered, page.to_json(orient='records', date_format='iso'))
+
+
+def open_store(path=STORE_PATH):
+    # One SessionStore per database file, shared by every request
+    path = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = SessionStore(path)
+        return store
+
+
+class UserSessions:
+    # One user's rows in a store, in place of a Dataset when selecting
+    def __init__(self, store, user_id):
+        self.store = store
+        self.user_id = user_id
+        self.source = ('store', store.path, user_id)
+        self.version = self.source + (store.version(user_id),)
+
+    @cached_property
+    def goals(self):
+        return self.store.goals(self.user_id)
+
+
+class StoreSelection(Selection):
+    # Filters, summary stats and daily totals run as SQL; only the rows a chart
+    # actually plots are read into pandas
+    @property
+    def filters(self):
+        return {
+            'start_date': self.start_date,
+            'end_date': self.end_date,
+            'goals': self.goals,
+            'search_query': self.search_query,
+            'search_mode': self.search_mode,
+        }
+
+    @cached_property
+    def df(self):
+        with stage('filter'):
+            return self.dataset.store.sessions(self.dataset.user_id, **self.filters)
+
+    @cached_property
+    def df_filtered(self):
+        with stage('filter'):
+            if 'df' in self.__dict__:
+                return self.df[self.df['Time'] != 60]
+            return self.dataset.store.sessions(self.dataset.user_id, exclude_60=True, **self.filters)
+
+    def frame(self, columns, filtered=False):
+        return (self.df_filtered if filtered else self.df)[columns]
+
+    @cached_property
+    def daily(self):
+        with stage('daily_totals'):
+            return self.dataset.store.daily_totals(self.dataset.user_id, **self.filters)
+
+    @cached_property
+    def summary_stats(self):
+        with stage('summary_stats'):
+            return self.dataset.store.summary_stats(self.dataset.user_id, **self.filters)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import session CSV files into the multi-user session store')
+    parser.add_argument('paths', nargs='+',
+                        help='CSV files, or directories of <user>.csv files as written by main.py --users')
+    parser.add_argument('--db', default=STORE_PATH, help='SQLite database file')
+    parser.add_argument('--user', help='user the sessions belong to (default: the CSV file name)')
+    parser.add_argument('--replace', action='store_true', help="drop each user's stored sessions first")
+    args = parser.parse_args()
+
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith('.csv'))
+        else:
+            files.append(path)
+    store = open_store(args.db)
+    for file_path in files:
+        user_id = args.user or os.path.splitext(os.path.basename(file_path))[0]
+        added = store.import_csv(user_id, file_path, args.replace)
+        print(f"{user_id}: {added} sessions imported from {file_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import analytics
+import dataset
+import main
+
+GOALS = ['No Goal', 'pcb', 'website', 'firmware']
+WORDS = 'pcb design firmware website api dashboard usb shader parser badge'.split()
+
+
+def api_sessions(rows, seed=0, start='2024-03-01'):
+    # Shaped like the history endpoint's data: unsorted, mostly 60-minute sessions
+    rng = np.random.default_rng(seed)
+    offsets = rng.choice(30 * 86_400_000, rows, replace=False)
+    created_at = pd.Timestamp(start, tz='UTC') + pd.to_timedelta(offsets, unit='ms')
+    time = np.where(rng.random(rows) < 0.6, 60, rng.integers(1, 60, rows))
+    return [
+        {
+            'createdAt': stamp.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (stamp.microsecond // 1000),
+            'time': int(minutes),
+            'elapsed': int(rng.integers(0, minutes + 1)),
+            'goal': GOALS[rng.integers(len(GOALS))],
+            'ended': bool(rng.random() < 0.9),
+            'work': ' '.join(rng.choice(WORDS, 3)),
+        }
+        for stamp, minutes in zip(created_at, time)
+    ]
+
+
+class HistoryServer(ThreadingHTTPServer):
+    # Serves /api/history/<user_id> from histories; statuses queued in failures are sent first
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), HistoryHandler)
+        self.histories = {}
+        self.failures = {}
+        self.bodies = {}
+        self.requests = []
+
+    @property
+    def url(self):
+        return 'http://%s:%d/api/history/{user_id}' % self.server_address
+
+
+class HistoryHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        user_id = self.path.rsplit('/', 1)[-1]
+        server = self.server
+        server.requests.append(user_id)
+        if server.failures.get(user_id):
+            self.send_error(server.failures[user_id].pop(0))
+            return
+        if user_id in server.bodies:
+            body = server.bodies[user_id]
+        elif user_id in server.histories:
+            body = json.dumps({'ok': True, 'data': server.histories[user_id]}).encode()
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def history_server(monkeypatch):
+    server = HistoryServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(main, 'API_URL', server.url)
+    monkeypatch.setattr(main, 'RETRY_BACKOFF', 0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sessions_csv(tmp_path):
+    path = tmp_path / 'sessions.csv'
+    main.write_to_csv(api_sessions(2000), str(path))
+    yield str(path)
+    dataset.invalidate(str(path))
+    analytics._selections.clear()
@@ -0,0 +1,134 @@
+import gc
+import weakref
+
+import numpy as np
+import pandas as pd
+import pandas.testing as tm
+import pytest
+
+import analytics
+from dataset import build_daily_rollup, load_dataset, with_daily_means
+from tests.conftest import GOALS
+
+WINDOWS = [
+    (None, None),
+    ('2024-03-05', None),
+    (None, '2024-03-20'),
+    ('2024-03-05', '2024-03-20'),
+    ('2024-03-05 13:30', '2024-03-20 06:15:00.5'),
+    ('2024-03-10 23:59:59', '2024-03-11 00:00:01'),
+    ('2024-03-20', '2024-03-05'),
+]
+# Bounds with an offset: the edge days are UTC days, not days in the bound's own timezone
+OFFSET_WINDOWS = [
+    ('2024-03-05T22:00:00-05:00', None),
+    (None, '2024-03-20T01:30:00+09:00'),
+    ('2024-03-05T00:00:00+05:30', '2024-03-20T00:00:00-08:00'),
+    ('2024-03-10T20:00:00-04:00', '2024-03-11T06:00:00+05:00'),
+]
+
+
+def utc_bound(value):
+    bound = pd.Timestamp(value)
+    return bound.tz_localize('UTC') if bound.tzinfo is None else bound.tz_convert('UTC')
+
+
+def mask_rows(df, start_date=None, end_date=None, goals=(), search_query=None):
+    # The same selection as plain boolean masks over the whole frame
+    mask = df['Created At'].notna()
+    if start_date:
+        mask &= df['Created At'] >= utc_bound(start_date)
+    if end_date:
+        mask &= df['Created At'] <= utc_bound(end_date)
+    if goals:
+        mask &= df['Goal'].isin(goals)
+    if search_query:
+        text = df.astype(str).apply(lambda row: '\x1f'.join(row).lower(), axis=1)
+        mask &= text.str.contains(search_query.lower(), regex=False)
+    return df[mask]
+
+
+def mask_daily(df):
+    return with_daily_means(build_daily_rollup(df).groupby(level='Day').sum())
+
+
+@pytest.mark.parametrize('start_date, end_date', WINDOWS + OFFSET_WINDOWS)
+@pytest.mark.parametrize('goals', [(), ('pcb',), ('pcb', 'website', 'missing')])
+def test_daily_totals_parity(sessions_csv, start_date, end_date, goals):
+    dataset = load_dataset(sessions_csv)
+    daily = analytics.daily_totals(dataset, start_date, end_date, list(goals))
+    expected = mask_daily(mask_rows(dataset.df, start_date, end_date, goals))
+    tm.assert_frame_equal(daily[daily['sessions'] > 0], expected, check_dtype=False, check_freq=False)
+
+
+@pytest.mark.parametrize('start_date, end_date', OFFSET_WINDOWS)
+def test_offset_bounds_charts(sessions_csv, start_date, end_date):
+    dataset = load_dataset(sessions_csv)
+    expected = mask_daily(mask_rows(dataset.df, start_date, end_date))
+    selection = analytics.Selection(dataset, start_date, end_date)
+    sessions = selection.chart('sessions_over_time').data.set_index('Day')['sessions']
+    tm.assert_series_equal(sessions, expected['sessions'], check_dtype=False, check_freq=False)
+    elapsed = selection.chart('total_elapsed_time_over_time').data.set_index('Day')['elapsed_excl_60']
+    tm.assert_series_equal(elapsed, expected.loc[expected['sessions_excl_60'] > 0, 'elapsed_excl_60'],
+                           check_dtype=False, check_freq=False)
+
+
+@pytest.mark.parametrize('start_date, end_date', WINDOWS)
+@pytest.mark.parametrize('goals, search_query, search_mode', [
+    ((), None, None),
+    (('firmware',), None, None),
+    ((), 'usb', None),
+    (('pcb', 'website'), 'PARSER', None),
+    ((), 'design api', 'words'),
+])
+def test_selection_rows_parity(sessions_csv, start_date, end_date, goals, search_query, search_mode):
+    dataset = load_dataset(sessions_csv)
+    selection = analytics.Selection(dataset, start_date, end_date, goals, search_query, search_mode)
+    if search_mode == 'words':
+        expected = mask_rows(dataset.df, start_date, end_date, goals)
+        words = expected['Goal'].astype(str) + ' ' + expected['Work'].astype(str)
+        matches = [{'design', 'api'} <= set(found) for found in words.str.lower().str.findall(r'\w+')]
+        expected = expected[np.array(matches, dtype=bool)]
+    else:
+        expected = mask_rows(dataset.df, start_date, end_date, goals, search_query)
+    tm.assert_frame_equal(selection.df, expected)
+    tm.assert_frame_equal(selection.df_filtered, expected[expected['Time'] != 60])
+    assert selection.summary_stats == analytics.summary_stats(expected)
+    tm.assert_frame_equal(selection.daily, mask_daily(expected), check_dtype=False, check_freq=False)
+
+
+def test_downsampled_charts_keep_extremes(sessions_csv):
+    dataset = load_dataset(sessions_csv)
+    selection = analytics.Selection(dataset, max_points=50)
+    chart = selection.chart('session_time_over_time')
+    assert len(chart.data) == 50
+    assert chart.data['Created At'].iloc[0] == dataset.df['Created At'].min()
+    assert chart.data['Created At'].iloc[-1] == dataset.df['Created At'].max()
+    # Histograms are binned by the plotting backend, bars are already one per goal
+    for chart in selection.charts(analytics.CHARTS):
+        if chart.kind in ('line', 'scatter'):
+            assert len(chart.data) <= 50
+
+
+def test_goal_distribution_counts(sessions_csv):
+    dataset = load_dataset(sessions_csv)
+    counts = analytics.Selection(dataset).summary_stats['sessions_per_goal']
+    assert set(counts) <= set(GOALS)
+    assert sum(counts.values()) == len(dataset.df)
+    assert np.isclose(analytics.Selection(dataset).summary_stats['average_session_time'], dataset.df['Time'].mean())
+
+
+def test_superseded_dataset_is_released(sessions_csv):
+    old = load_dataset(sessions_csv)
+    analytics.select(old)
+    analytics.select(old, goals=['pcb'])
+    released = weakref.ref(old)
+    del old
+    with open(sessions_csv, 'a', newline='') as file:
+        file.write('2024-04-01T00:00:00.000Z,60,60,pcb,true,late\n')
+    new = load_dataset(sessions_csv)
+    selection = analytics.select(new)
+    gc.collect()
+    assert released() is None
+    assert [cached.dataset for cached in analytics._selections.values()] == [new]
+    assert analytics.select(new) is selection
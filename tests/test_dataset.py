@@ -0,0 +1,70 @@
+import os
+
+import pandas.testing as tm
+import pytest
+
+import dataset
+from dataset import load_dataset, preprocess_data, read_csv
+
+LATER_ROW = '2024-05-01T00:00:00.000Z,30,20,pcb,true,late session\n'
+EARLIER_ROW = '2024-02-01T00:00:00.000Z,30,20,pcb,true,early session\n'
+
+
+def full_load(path):
+    df = preprocess_data(read_csv(path))
+    return df.sort_values('Created At', kind='stable', na_position='last', ignore_index=True)
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    # Counts the full reloads, so a test can tell them from the append path
+    calls = []
+    read = dataset.read_csv
+    monkeypatch.setattr(dataset, 'read_csv', lambda path: calls.append(path) or read(path))
+    return calls
+
+
+def append(path, text):
+    with open(path, 'a', newline='') as file:
+        file.write(text)
+
+
+def test_append_parses_only_new_rows(sessions_csv, loads):
+    before = load_dataset(sessions_csv)
+    append(sessions_csv, LATER_ROW)
+    after = load_dataset(sessions_csv)
+    assert len(loads) == 1
+    assert after.version != before.version
+    tm.assert_frame_equal(after.df, full_load(sessions_csv), check_categorical=False)
+
+
+def test_older_rows_force_a_reload(sessions_csv, loads):
+    load_dataset(sessions_csv)
+    append(sessions_csv, EARLIER_ROW)
+    tm.assert_frame_equal(load_dataset(sessions_csv).df, full_load(sessions_csv))
+    assert len(loads) == 2
+
+
+def test_rewrite_keeping_the_tail_forces_a_reload(sessions_csv, loads):
+    load_dataset(sessions_csv)
+    with open(sessions_csv, newline='') as file:
+        header, first, *rest = file.readlines()
+    # Same file and the old last bytes at the same offset, but the first session's Time changed
+    fields = first.split(',')
+    fields[1] = '1' * len(fields[1]) if fields[1] != '1' * len(fields[1]) else '2' * len(fields[1])
+    with open(sessions_csv, 'r+', newline='') as file:
+        file.writelines([header, ','.join(fields)] + rest)
+        file.write(LATER_ROW)
+    tm.assert_frame_equal(load_dataset(sessions_csv).df, full_load(sessions_csv))
+    assert len(loads) == 2
+
+
+def test_replaced_file_forces_a_reload(sessions_csv, loads):
+    load_dataset(sessions_csv)
+    with open(sessions_csv, 'rb') as file:
+        data = file.read()
+    with open(sessions_csv + '.new', 'wb') as file:
+        file.write(data + LATER_ROW.encode())
+    os.replace(sessions_csv + '.new', sessions_csv)
+    tm.assert_frame_equal(load_dataset(sessions_csv).df, full_load(sessions_csv))
+    assert len(loads) == 2
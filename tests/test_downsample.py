@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from downsample import bin_points, downsample_line, lttb
+
+
+def test_lttb_keeps_endpoints_and_peaks():
+    x = np.arange(1000, dtype=float)
+    y = np.sin(x / 50)
+    y[500] = 10
+    y[700] = -10
+    indices = lttb(x, y, 100)
+    assert len(indices) == 100
+    assert indices[0] == 0 and indices[-1] == 999
+    assert np.all(np.diff(indices) > 0)
+    assert {500, 700} <= set(indices)
+
+
+@pytest.mark.parametrize('threshold', [0, 2, 1000, 5000])
+def test_lttb_passthrough(threshold):
+    x = np.arange(1000, dtype=float)
+    assert np.array_equal(lttb(x, x, threshold), np.arange(1000))
+
+
+def test_downsample_line_datetimes():
+    df = pd.DataFrame({
+        'Created At': pd.date_range('2024-01-01', periods=500, freq='h', tz='UTC'),
+        'Time': np.arange(500) % 60,
+    })
+    df.loc[3, 'Created At'] = pd.NaT
+    reduced = downsample_line(df, 'Created At', 'Time', 50)
+    assert len(reduced) == 50
+    assert reduced['Created At'].notna().all()
+    assert reduced['Created At'].is_monotonic_increasing
+    assert len(downsample_line(df, 'Created At', 'Time', 1000)) == 499
+
+
+def test_bin_points_merges_identical_points():
+    df = pd.DataFrame({'Time': [1, 1, 2, 2, 2, 3], 'Elapsed': [1, 1, 2, 2, 2, None]})
+    points = bin_points(df, 'Time', 'Elapsed', 10).sort_values('Time', ignore_index=True)
+    assert points[['Time', 'Elapsed', 'Sessions']].values.tolist() == [[1, 1, 2], [2, 2, 3]]
+
+
+def test_bin_points_grid():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'Time': rng.random(10_000) * 60, 'Elapsed': rng.random(10_000) * 60})
+    points = bin_points(df, 'Time', 'Elapsed', 100)
+    assert len(points) <= 100
+    assert points['Sessions'].sum() == len(df)
+    assert points['Time'].between(0, 60).all() and points['Elapsed'].between(0, 60).all()
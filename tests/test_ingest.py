@@ -0,0 +1,66 @@
+import os
+import shutil
+
+import pandas.testing as tm
+import pytest
+
+import ingest
+import main
+from dataset import invalidate, load_dataset, read_csv, snapshot_is_fresh, snapshot_path, write_snapshot
+from tests.conftest import api_sessions
+
+
+def stage_upload(tmp_path, sessions, file_path):
+    source = tmp_path / 'upload.csv'
+    main.write_to_csv(sessions, str(source))
+    with open(source, 'rb') as stream:
+        return ingest.save_upload(stream, file_path)
+
+
+def test_ingest_replaces_csv_and_snapshot(tmp_path, sessions_csv):
+    write_snapshot(sessions_csv)
+    # The upload is older than the live snapshot, which must not be read for it
+    upload = stage_upload(tmp_path, api_sessions(300, seed=9), sessions_csv)
+    os.utime(upload, (0, 0))
+    assert ingest.ingest_csv(upload, sessions_csv) == 300
+    assert not os.path.exists(upload)
+    assert snapshot_is_fresh(sessions_csv)
+    assert [name for name in os.listdir(tmp_path) if name.endswith(('.upload', '.tmp'))] == []
+    assert len(load_dataset(sessions_csv).df) == 300
+    snapshot = read_csv(sessions_csv)
+    os.remove(snapshot_path(sessions_csv))
+    tm.assert_frame_equal(snapshot.astype({'Goal': str}), ingest.read_upload(sessions_csv).astype({'Goal': str}))
+
+
+def test_rejected_upload_keeps_live_files(tmp_path, sessions_csv):
+    write_snapshot(sessions_csv)
+    before = tmp_path / 'before.csv'
+    shutil.copy(sessions_csv, before)
+    invalidate(sessions_csv)
+    rows = len(load_dataset(sessions_csv).df)
+    sessions = api_sessions(10)
+    sessions[4]['time'] = 'soon'
+    upload = stage_upload(tmp_path, sessions, sessions_csv)
+    with pytest.raises(ingest.UploadError, match="Time: 'soon'"):
+        ingest.ingest_csv(upload, sessions_csv)
+    assert not os.path.exists(upload)
+    assert open(sessions_csv, 'rb').read() == before.read_bytes()
+    assert snapshot_is_fresh(sessions_csv)
+    assert len(load_dataset(sessions_csv).df) == rows
+
+
+def test_snapshot_failure_after_swap_is_not_fatal(tmp_path, sessions_csv, monkeypatch):
+    write_snapshot(sessions_csv)
+    upload = stage_upload(tmp_path, api_sessions(50, seed=7), sessions_csv)
+    snapshot = snapshot_path(sessions_csv)
+    replace = os.replace
+
+    def fail_snapshot(src, dst):
+        if dst == snapshot:
+            raise OSError('disk full')
+        replace(src, dst)
+
+    monkeypatch.setattr(ingest.os, 'replace', fail_snapshot)
+    assert ingest.ingest_csv(upload, sessions_csv) == 50
+    assert not os.path.exists(snapshot)
+    assert len(load_dataset(sessions_csv).df) == 50
@@ -0,0 +1,115 @@
+import csv
+import json
+
+import pytest
+
+import main
+from dataset import snapshot_is_fresh
+from tests.conftest import api_sessions
+
+
+def read_rows(path):
+    with open(path, newline='') as file:
+        return list(csv.reader(file))
+
+
+def sorted_rows(sessions):
+    ordered = sorted(sessions, key=lambda session: main.parse_created_at(session['createdAt']))
+    return [main.CSV_COLUMNS] + [[str(value) for value in main.session_row(session)] for session in ordered]
+
+
+def test_fetch_user_history(history_server):
+    history_server.histories['U1'] = api_sessions(5)
+    with main.create_http_session() as http:
+        assert main.fetch_user_history(http, 'U1') == history_server.histories['U1']
+
+
+def test_retries_server_errors(history_server):
+    history_server.histories['U1'] = api_sessions(5)
+    history_server.failures['U1'] = [503, 502]
+    with main.create_http_session() as http:
+        assert len(main.fetch_user_history(http, 'U1')) == 5
+    assert history_server.requests == ['U1'] * 3
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_sync_users(history_server, tmp_path, stream):
+    history_server.histories['U1'] = api_sessions(50, seed=1)
+    history_server.histories['U2'] = api_sessions(20, seed=2)
+    results = main.sync_users(['U1', 'U2', 'U1', 'missing'], str(tmp_path), max_workers=2, stream=stream)
+    assert results == {'U1': 50, 'U2': 20, 'missing': None}
+    assert sorted(history_server.requests) == ['U1', 'U2', 'missing']
+    assert read_rows(tmp_path / 'U1.csv') == sorted_rows(history_server.histories['U1'])
+    # Full syncs leave a snapshot the next load can read instead of the CSV
+    assert snapshot_is_fresh(str(tmp_path / 'U1.csv'))
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_incremental_sync_is_idempotent(history_server, tmp_path, stream):
+    sessions = api_sessions(60, seed=3)
+    history_server.histories['U1'] = sessions[:40]
+    assert main.sync_users(['U1'], str(tmp_path), incremental=True, stream=stream) == {'U1': 40}
+    history_server.histories['U1'] = sessions
+    # Only the sessions newer than the watermark are appended
+    expected = len([s for s in sessions[40:] if main.parse_created_at(s['createdAt'])
+                    > max(main.parse_created_at(s['createdAt']) for s in sessions[:40])])
+    assert main.sync_users(['U1'], str(tmp_path), incremental=True, stream=stream) == {'U1': expected}
+    first = read_rows(tmp_path / 'U1.csv')
+    assert main.sync_users(['U1'], str(tmp_path), incremental=True, stream=stream) == {'U1': 0}
+    assert read_rows(tmp_path / 'U1.csv') == first
+    assert len(first) == 41 + expected
+
+
+@pytest.mark.parametrize('run_size', [1, 7, 100, 1000])
+def test_external_merge_sort(tmp_path, run_size):
+    sessions = api_sessions(100, seed=4)
+    path = tmp_path / 'sessions.csv'
+    assert main.write_sessions_streaming(iter(sessions), str(path), run_size=run_size) == 100
+    assert read_rows(path) == sorted_rows(sessions)
+    assert main.read_watermark(str(path)) == max(main.parse_created_at(s['createdAt']) for s in sessions)
+    assert list(tmp_path.glob('*.run')) == [] and list(tmp_path.glob('*.tmp')) == []
+
+
+def test_external_merge_sort_empty(tmp_path):
+    path = tmp_path / 'sessions.csv'
+    assert main.write_sessions_streaming(iter([]), str(path)) == 0
+    assert read_rows(path) == [main.CSV_COLUMNS]
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 16, 1 << 20])
+def test_iter_sessions(size):
+    sessions = api_sessions(10, seed=5) + [{'work': 'café ☕', 'time': 12345, 'nested': {'a': [1, 2]}}]
+    document = {'ok': True, 'count': 1.5e3, 'data': sessions, 'next': None}
+    body = json.dumps(document, ensure_ascii=False, indent=1).encode()
+    assert list(main.iter_sessions(chunked(body, size))) == sessions
+
+
+@pytest.mark.parametrize('body', [b'{}', b'{"ok": true}', b' {"data": [] } '])
+def test_iter_sessions_without_data(body):
+    assert list(main.iter_sessions(chunked(body, 2))) == []
+
+
+@pytest.mark.parametrize('body', [b'', b'{"data": [1, 2', b'[1, 2]', b'{"data": [1 2]}'])
+def test_iter_sessions_rejects_malformed_json(body):
+    with pytest.raises(ValueError):
+        list(main.iter_sessions(chunked(body, 3)))
+
+
+def test_sync_users_reports_malformed_history(history_server, tmp_path):
+    history_server.histories['U1'] = api_sessions(5)
+    history_server.bodies['U2'] = b'{"data": [{"createdAt": '
+    for stream in (False, True):
+        assert main.sync_users(['U1', 'U2'], str(tmp_path), stream=stream) == {'U1': 5, 'U2': None}
+
+
+def test_streaming_output_mode(tmp_path):
+    path = tmp_path / 'sessions.csv'
+    main.write_sessions_streaming(iter(api_sessions(20)), str(path), run_size=5)
+    assert path.stat().st_mode & 0o777 == main.OUTPUT_FILE_MODE
+    path.chmod(0o640)
+    main.write_sessions_streaming(iter(api_sessions(20)), str(path))
+    assert path.stat().st_mode & 0o777 == 0o640
@@ -0,0 +1,47 @@
+import time
+
+import pytest
+from flask import Flask, Response, session
+
+import metrics
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    metrics.init_app(app, is_admin=lambda: session.get('role') == 'admin')
+
+    @app.route('/test_stream')
+    def stream():
+        def body():
+            time.sleep(0.3)
+            yield 'done'
+        return Response(body(), mimetype='text/plain')
+
+    return app.test_client()
+
+
+def request_seconds(route):
+    return sum(total for labels, (_, total, _) in metrics.REQUEST_SECONDS._series.items() if labels[0] == route)
+
+
+def test_streamed_response_is_timed_until_closed(client):
+    before = request_seconds('/test_stream')
+    response = client.get('/test_stream')
+    assert response.get_data(as_text=True) == 'done'
+    response.close()
+    assert request_seconds('/test_stream') - before >= 0.3
+
+
+def test_metrics_requires_admin_or_token(client):
+    assert client.get('/metrics').status_code == 403
+    client.application.config['METRICS_TOKEN'] = 'secret'
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
+    client.application.config['METRICS_TOKEN'] = None
+    with client.session_transaction() as state:
+        state['role'] = 'admin'
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert 'arcade_request_duration_seconds' in response.get_data(as_text=True)
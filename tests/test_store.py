@@ -0,0 +1,39 @@
+import pandas.testing as tm
+import pytest
+
+import analytics
+from dataset import load_dataset
+from store import SessionStore, StoreSelection, UserSessions
+from tests.test_analytics import OFFSET_WINDOWS, WINDOWS, mask_daily, mask_rows
+
+
+@pytest.fixture
+def store(tmp_path, sessions_csv):
+    store = SessionStore(str(tmp_path / 'sessions.db'))
+    store.import_csv('U1', sessions_csv)
+    yield store
+    store.close()
+
+
+def test_import_is_idempotent(store, sessions_csv):
+    count = store.count('U1')
+    assert count == len(load_dataset(sessions_csv).df)
+    assert store.import_csv('U1', sessions_csv) == 0
+    assert store.count('U1') == count
+    assert store.import_csv('U1', sessions_csv, replace=True) == count
+    assert store.count('U2') == 0
+
+
+@pytest.mark.parametrize('start_date, end_date', WINDOWS + OFFSET_WINDOWS)
+@pytest.mark.parametrize('goals, search_query', [((), None), (('pcb', 'firmware'), None), ((), 'Shader')])
+def test_store_parity(store, sessions_csv, start_date, end_date, goals, search_query):
+    expected = mask_rows(load_dataset(sessions_csv).df, start_date, end_date, goals, search_query)
+    selection = StoreSelection(UserSessions(store, 'U1'), start_date, end_date, goals, search_query)
+    tm.assert_frame_equal(selection.df.reset_index(drop=True), expected.reset_index(drop=True),
+                          check_dtype=False, check_categorical=False)
+    stats = selection.summary_stats
+    expected_stats = analytics.summary_stats(expected)
+    assert stats.pop('sessions_per_goal') == expected_stats.pop('sessions_per_goal')
+    assert stats == pytest.approx(expected_stats, nan_ok=True)
+    tm.assert_frame_equal(selection.daily, mask_daily(expected), check_dtype=False, check_freq=False,
+                          check_index_type=False)
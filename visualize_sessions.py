@@ -1,192 +1,218 @@
-import pandas as pd
+import argparse
+import os
+import time
+
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-# Read the CSV file
-CSV_FILE_PATH = r"C:\Users\ysing\Downloads\arcade-api-main\arcade-api-main\arcade_sessions.csv"
-
-def read_csv(file_path):
-    return pd.read_csv(file_path, encoding='ISO-8859-1')
-
-def preprocess_data(df):
-    # Convert 'Created At' to datetime
-    df['Created At'] = pd.to_datetime(df['Created At'])
-    return df
-
-def filter_sessions(df):
-    return df[df['Time'] != 60]
-
-def plot_session_times(df):
-    plt.figure(figsize=(10, 6))
-    sns.lineplot(x='Created At', y='Time', data=df, marker='o')
-    plt.title('Session Time Over Time')
-    plt.xlabel('Date')
-    plt.ylabel('Session Time (minutes)')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.show()
-
-def plot_goal_distribution(df):
-    plt.figure(figsize=(10, 6))
-    sns.countplot(data=df, x='Goal', order=df['Goal'].value_counts().index)
-    plt.title('Goal Distribution')
-    plt.xlabel('Goal')
-    plt.ylabel('Count')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.show()
-
-def plot_session_duration_distribution(df):
-    plt.figure(figsize=(10, 6))
-    sns.histplot(df['Time'], bins=20, kde=True)
-    plt.title('Session Duration Distribution')
-    plt.xlabel('Session Duration (minutes)')
-    plt.ylabel('Frequency')
-    plt.tight_layout()
-    plt.show()
-
-def plot_elapsed_time_vs_goal(df):
-    plt.figure(figsize=(10, 6))
-    sns.barplot(data=df, x='Goal', y='Elapsed', ci=None, estimator=sum, order=df['Goal'].value_counts().index)
-    plt.title('Total Elapsed Time by Goal')
-    plt.xlabel('Goal')
-    plt.ylabel('Total Elapsed Time (minutes)')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.show()
-
-def plot_sessions_per_day(df):
-    plt.figure(figsize=(10, 6))
-    df['Date'] = df['Created At'].dt.date
-    sns.countplot(data=df, x='Date', order=df['Date'].value_counts().index)
-    plt.title('Sessions Per Day')
-    plt.xlabel('Date')
-    plt.ylabel('Number of Sessions')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.show()
-
-def plot_session_boxplot(df):
-    plt.figure(figsize=(10, 6))
-    sns.boxplot(data=df, y='Time')
-    plt.title('Box Plot of Session Times')
-    plt.ylabel('Session Time (minutes)')
-    plt.tight_layout()
-    plt.show()
-
-def plot_correlation_heatmap(df):
-    plt.figure(figsize=(10, 6))
-    corr = df[['Time', 'Elapsed']].corr()
-    sns.heatmap(corr, annot=True, cmap='coolwarm', vmin=-1, vmax=1)
-    plt.title('Correlation Heatmap')
-    plt.tight_layout()
-    plt.show()
-
-def plot_goal_pie_chart(df):
-    plt.figure(figsize=(10, 6))
-    df['Goal'].value_counts().plot.pie(autopct='%1.1f%%', startangle=90, counterclock=False)
-    plt.title('Goals Proportion')
-    plt.ylabel('')
-    plt.tight_layout()
-    plt.show()
-
-def plot_session_time_vs_elapsed(df):
-    plt.figure(figsize=(10, 6))
-    sns.scatterplot(data=df, x='Time', y='Elapsed')
-    plt.title('Session Time vs Elapsed Time')
-    plt.xlabel('Session Time (minutes)')
-    plt.ylabel('Elapsed Time (minutes)')
-    plt.tight_layout()
-    plt.show()
-
-def plot_average_session_time_per_goal(df):
-    plt.figure(figsize=(10, 6))
-    sns.barplot(data=df, x='Goal', y='Time', estimator='mean', ci=None, order=df['Goal'].value_counts().index)
-    plt.title('Average Session Time per Goal')
-    plt.xlabel('Goal')
-    plt.ylabel('Average Session Time (minutes)')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.show()
-
-def plot_total_session_time_over_time(df):
-    df['Cumulative Time'] = df['Time'].cumsum()
-    plt.figure(figsize=(10, 6))
-    sns.lineplot(x='Created At', y='Cumulative Time', data=df, marker='o')
-    plt.title('Total Session Time Over Time')
-    plt.xlabel('Date')
-    plt.ylabel('Cumulative Session Time (minutes)')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.show()
-
-def plot_average_session_time_per_day(df):
-    df['Date'] = df['Created At'].dt.date
-    avg_session_time_per_day = df.groupby('Date')['Time'].mean().reset_index()
-    plt.figure(figsize=(10, 6))
-    sns.lineplot(x='Date', y='Time', data=avg_session_time_per_day, marker='o')
-    plt.title('Average Session Time Per Day')
-    plt.xlabel('Date')
-    plt.ylabel('Average Session Time (minutes)')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.show()
-
-def plot_total_sessions_per_day(df):
-    df['Date'] = df['Created At'].dt.date
-    sessions_per_day = df['Date'].value_counts().reset_index()
-    sessions_per_day.columns = ['Date', 'Sessions']
-    plt.figure(figsize=(10, 6))
-    sns.lineplot(x='Date', y='Sessions', data=sessions_per_day.sort_values('Date'), marker='o')
-    plt.title('Total Sessions Per Day')
-    plt.xlabel('Date')
-    plt.ylabel('Total Sessions')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.show()
-
-def plot_filtered_elapsed_time_vs_goal(df_filtered):
-    plt.figure(figsize=(10, 6))
-    sns.barplot(data=df_filtered, x='Goal', y='Elapsed', ci=None, estimator=sum, order=df_filtered['Goal'].value_counts().index)
-    plt.title('Total Elapsed Time by Goal (Excluding 60-min Sessions)')
-    plt.xlabel('Goal')
-    plt.ylabel('Total Elapsed Time (minutes)')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.show()
-
-def plot_filtered_session_time_vs_elapsed(df_filtered):
-    plt.figure(figsize=(10, 6))
-    sns.scatterplot(data=df_filtered, x='Time', y='Elapsed')
-    plt.title('Session Time vs Elapsed Time (Excluding 60-min Sessions)')
-    plt.xlabel('Session Time (minutes)')
-    plt.ylabel('Elapsed Time (minutes)')
-    plt.tight_layout()
-    plt.show()
+from analytics import goal_counts, select
+from dataset import CSV_FILE_PATH, load_dataset
+
+FIGSIZE = (10, 6)
+
+
+class ChartData:
+    # Every derived column, ordering and aggregate the charts need, computed once
+    # up front instead of inside each plot (which used to add columns to the frame)
+    def __init__(self, selection):
+        df = selection.df
+        df_filtered = selection.df_filtered
+        self.df = df
+        self.df_filtered = df_filtered
+        self.daily = selection.daily.reset_index()
+
+        self.goal_counts = goal_counts(df)
+        self.goal_order = self.goal_counts.index
+        by_goal = df.groupby('Goal', observed=True)
+        self.elapsed_by_goal = by_goal['Elapsed'].sum().reindex(self.goal_order)
+        self.mean_time_by_goal = by_goal['Time'].mean().reindex(self.goal_order)
+        filtered_order = goal_counts(df_filtered).index
+        self.filtered_elapsed_by_goal = (
+            df_filtered.groupby('Goal', observed=True)['Elapsed'].sum().reindex(filtered_order))
+
+        # Busiest days first, from the daily rollup rather than a per-row date column
+        per_day = selection.daily['sessions']
+        self.sessions_per_day = per_day[per_day > 0].sort_values(ascending=False, kind='stable')
+        self.cumulative_time = df['Time'].cumsum()
+        self.corr = df[['Time', 'Elapsed']].corr()
+
+
+def _goal_bars(ax, values):
+    ax.bar(values.index.astype(str), values.to_numpy())
+    ax.tick_params(axis='x', labelrotation=45)
+
+def plot_session_times(ax, data):
+    ax.plot(data.df['Created At'], data.df['Time'], marker='o')
+    ax.set_title('Session Time Over Time')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Session Time (minutes)')
+    ax.tick_params(axis='x', labelrotation=45)
+
+def plot_goal_distribution(ax, data):
+    _goal_bars(ax, data.goal_counts)
+    ax.set_title('Goal Distribution')
+    ax.set_xlabel('Goal')
+    ax.set_ylabel('Count')
+
+def plot_session_duration_distribution(ax, data):
+    sns.histplot(data.df['Time'], bins=20, kde=True, ax=ax)
+    ax.set_title('Session Duration Distribution')
+    ax.set_xlabel('Session Duration (minutes)')
+    ax.set_ylabel('Frequency')
+
+def plot_elapsed_time_vs_goal(ax, data):
+    _goal_bars(ax, data.elapsed_by_goal)
+    ax.set_title('Total Elapsed Time by Goal')
+    ax.set_xlabel('Goal')
+    ax.set_ylabel('Total Elapsed Time (minutes)')
+
+def plot_sessions_per_day(ax, data):
+    days = data.sessions_per_day
+    ax.bar(days.index.strftime('%Y-%m-%d'), days.to_numpy())
+    ax.set_title('Sessions Per Day')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Number of Sessions')
+    ax.tick_params(axis='x', labelrotation=45)
+
+def plot_session_boxplot(ax, data):
+    sns.boxplot(data=data.df, y='Time', ax=ax)
+    ax.set_title('Box Plot of Session Times')
+    ax.set_ylabel('Session Time (minutes)')
+
+def plot_correlation_heatmap(ax, data):
+    sns.heatmap(data.corr, annot=True, cmap='coolwarm', vmin=-1, vmax=1, ax=ax)
+    ax.set_title('Correlation Heatmap')
+
+def plot_goal_pie_chart(ax, data):
+    data.goal_counts.plot.pie(autopct='%1.1f%%', startangle=90, counterclock=False, ax=ax)
+    ax.set_title('Goals Proportion')
+    ax.set_ylabel('')
+
+def plot_session_time_vs_elapsed(ax, data):
+    ax.scatter(data.df['Time'], data.df['Elapsed'])
+    ax.set_title('Session Time vs Elapsed Time')
+    ax.set_xlabel('Session Time (minutes)')
+    ax.set_ylabel('Elapsed Time (minutes)')
+
+def plot_average_session_time_per_goal(ax, data):
+    _goal_bars(ax, data.mean_time_by_goal)
+    ax.set_title('Average Session Time per Goal')
+    ax.set_xlabel('Goal')
+    ax.set_ylabel('Average Session Time (minutes)')
+
+def plot_total_session_time_over_time(ax, data):
+    ax.plot(data.df['Created At'], data.cumulative_time, marker='o')
+    ax.set_title('Total Session Time Over Time')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Cumulative Session Time (minutes)')
+    ax.tick_params(axis='x', labelrotation=45)
+
+def plot_average_session_time_per_day(ax, data):
+    ax.plot(data.daily['Day'], data.daily['mean_time'], marker='o')
+    ax.set_title('Average Session Time Per Day')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Average Session Time (minutes)')
+    ax.tick_params(axis='x', labelrotation=45)
+
+def plot_total_sessions_per_day(ax, data):
+    ax.plot(data.daily['Day'], data.daily['sessions'], marker='o')
+    ax.set_title('Total Sessions Per Day')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Total Sessions')
+    ax.tick_params(axis='x', labelrotation=45)
+
+def plot_filtered_elapsed_time_vs_goal(ax, data):
+    _goal_bars(ax, data.filtered_elapsed_by_goal)
+    ax.set_title('Total Elapsed Time by Goal (Excluding 60-min Sessions)')
+    ax.set_xlabel('Goal')
+    ax.set_ylabel('Total Elapsed Time (minutes)')
+
+def plot_filtered_session_time_vs_elapsed(ax, data):
+    ax.scatter(data.df_filtered['Time'], data.df_filtered['Elapsed'])
+    ax.set_title('Session Time vs Elapsed Time (Excluding 60-min Sessions)')
+    ax.set_xlabel('Session Time (minutes)')
+    ax.set_ylabel('Elapsed Time (minutes)')
+
+PLOTS = [
+    ('session_times', plot_session_times),
+    ('goal_distribution', plot_goal_distribution),
+    ('session_duration_distribution', plot_session_duration_distribution),
+    ('elapsed_time_vs_goal', plot_elapsed_time_vs_goal),
+    ('sessions_per_day', plot_sessions_per_day),
+    ('session_boxplot', plot_session_boxplot),
+    ('correlation_heatmap', plot_correlation_heatmap),
+    ('goal_pie_chart', plot_goal_pie_chart),
+    ('session_time_vs_elapsed', plot_session_time_vs_elapsed),
+    ('average_session_time_per_goal', plot_average_session_time_per_goal),
+    ('total_session_time_over_time', plot_total_session_time_over_time),
+    ('average_session_time_per_day', plot_average_session_time_per_day),
+    ('total_sessions_per_day', plot_total_sessions_per_day),
+    ('filtered_elapsed_time_vs_goal', plot_filtered_elapsed_time_vs_goal),
+    ('filtered_session_time_vs_elapsed', plot_filtered_session_time_vs_elapsed),
+]
+
+def show_plots(data):
+    for _, plot in PLOTS:
+        fig, ax = plt.subplots(figsize=FIGSIZE)
+        plot(ax, data)
+        fig.tight_layout()
+        plt.show()
+
+def render_plots(data, output_dir=None, image_format='png', pdf_path=None):
+    # One figure is cleared and redrawn for every chart rather than creating fifteen
+    pdf = None
+    if pdf_path:
+        from matplotlib.backends.backend_pdf import PdfPages
+        pdf = PdfPages(pdf_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    fig = plt.figure(figsize=FIGSIZE)
+    timings = []
+    try:
+        for name, plot in PLOTS:
+            started = time.perf_counter()
+            fig.clear()
+            plot(fig.add_subplot(), data)
+            fig.tight_layout()
+            if pdf is not None:
+                pdf.savefig(fig)
+            if output_dir:
+                fig.savefig(os.path.join(output_dir, f'{name}.{image_format}'))
+            timings.append((name, time.perf_counter() - started))
+    finally:
+        plt.close(fig)
+        if pdf is not None:
+            pdf.close()
+    return timings
 
 def main():
-    df = read_csv(CSV_FILE_PATH)
-    df = preprocess_data(df)
-    df_filtered = filter_sessions(df)
-    
-    print(df.describe())
-    plot_session_times(df)
-    plot_goal_distribution(df)
-    plot_session_duration_distribution(df)
-    plot_elapsed_time_vs_goal(df)
-    plot_sessions_per_day(df)
-    plot_session_boxplot(df)
-    plot_correlation_heatmap(df)
-    plot_goal_pie_chart(df)
-    plot_session_time_vs_elapsed(df)
-    plot_average_session_time_per_goal(df)
-    plot_total_session_time_over_time(df)
-    plot_average_session_time_per_day(df)
-    plot_total_sessions_per_day(df)
-    
-    print(df_filtered.describe())
-    plot_filtered_elapsed_time_vs_goal(df_filtered)
-    plot_filtered_session_time_vs_elapsed(df_filtered)
+    parser = argparse.ArgumentParser(description='Plot arcade session charts')
+    parser.add_argument('--csv', default=CSV_FILE_PATH, help='sessions CSV to plot')
+    parser.add_argument('--output-dir', help='write every chart to this directory instead of showing windows')
+    parser.add_argument('--format', default='png', help='image format for --output-dir (png, svg, pdf, ...)')
+    parser.add_argument('--pdf', help='write every chart as one page of this PDF instead of showing windows')
+    args = parser.parse_args()
+
+    headless = args.output_dir or args.pdf
+    if headless:
+        plt.switch_backend('Agg')
+
+    started = time.perf_counter()
+    data = ChartData(select(load_dataset(args.csv)))
+    prepared = time.perf_counter() - started
+
+    print(data.df.describe())
+    print(data.df_filtered.describe())
+
+    if not headless:
+        show_plots(data)
+        return
+
+    timings = render_plots(data, args.output_dir, args.format, args.pdf)
+    print(f"{'prepare data':<34}{prepared:8.3f} s")
+    for name, seconds in timings:
+        print(f"{name:<34}{seconds:8.3f} s")
+    print(f"{'total':<34}{prepared + sum(seconds for _, seconds in timings):8.3f} s")
 
 if __name__ == '__main__':
     main()